@@ -43,6 +43,9 @@ MIN_CP_THRESHOLD = float(os.getenv('MIN_CP_THRESHOLD', '0.5'))
 OUTPUT_DIR = Path(os.getenv('OUTPUT_DIR', Path(__file__).parent / 'output'))
 OUTPUT_DIR.mkdir(exist_ok=True, parents=True)
 
+# Persistent embedding cache (SQLite file, reused across runs)
+EMBEDDING_CACHE_PATH = Path(os.getenv('EMBEDDING_CACHE_PATH', OUTPUT_DIR / 'embedding_cache.db'))
+
 # Logging
 LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
 
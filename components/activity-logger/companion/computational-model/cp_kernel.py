@@ -0,0 +1,17 @@
+"""
+Context Precision Kernel
+Numba-compiled context-in-diff membership over CSR path-code arrays
+"""
+
+import numpy as np
+from numba import njit, prange
+
+
+@njit(parallel=True, cache=True)
+def context_hits_kernel(ctx_offsets, ctx_ids, diff_offsets, diff_ids, out_hits):
+    """Mark each context file found in its prompt's diff slice (CSR layout)"""
+    for p in prange(len(ctx_offsets) - 1):
+        diff = np.sort(diff_ids[diff_offsets[p]:diff_offsets[p + 1]])
+        for j in range(ctx_offsets[p], ctx_offsets[p + 1]):
+            k = np.searchsorted(diff, ctx_ids[j])
+            out_hits[j] = k < len(diff) and diff[k] == ctx_ids[j]
@@ -6,19 +6,96 @@ Supports both SQLite and PostgreSQL databases
 import sqlite3
 import json
 import os
-from typing import List, Dict, Optional, Any
+import sys
+import threading
+import weakref
+from collections import defaultdict
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import List, Dict, Iterable, Iterator, Mapping, Optional, Sequence, Any, Union
 from sqlalchemy import create_engine, text
 from sqlalchemy.engine import Engine
 import config
 
 
+# Lock waits: sqlite3's default for queries, and a short one for opt-in DDL
+SQLITE_BUSY_TIMEOUT_MS = 5000
+INDEX_BUSY_TIMEOUT_MS = 250
+
+# Positional (?) or named (:name) bind parameters
+QueryParams = Union[Sequence[Any], Mapping[str, Any]]
+
+# Allowed ORDER BY clauses for get_events/get_prompts/get_entries
+ORDER_BY_CLAUSES = frozenset({'timestamp ASC', 'timestamp DESC', 'id ASC', 'id DESC'})
+
+# Selectable columns per table (companion service schema, including migrations)
+TABLE_COLUMNS = {
+    'events': frozenset({
+        'id', 'session_id', 'workspace_path', 'timestamp', 'type', 'details',
+        'annotation', 'intent', 'tags', 'ai_generated', 'prompt_id'
+    }),
+    'prompts': frozenset({
+        'id', 'timestamp', 'text', 'status', 'linked_entry_id', 'source',
+        'workspace_id', 'workspace_path', 'workspace_name', 'composer_id',
+        'subtitle', 'lines_added', 'lines_removed', 'context_usage', 'mode',
+        'model_type', 'model_name', 'force_mode', 'is_auto', 'type', 'confidence',
+        'added_from_database', 'context_files_json', 'context_file_count',
+        'context_file_count_auto', 'context_file_count_explicit',
+        'context_file_count_tabs', 'context_window_size', 'conversation_id',
+        'conversation_index', 'conversation_title', 'parent_conversation_id',
+        'message_role', 'thinking_time', 'thinking_time_seconds',
+        'has_attachments', 'attachment_count', 'terminal_block_count',
+        'terminal_blocks_json'
+    }),
+    'entries': frozenset({
+        'id', 'session_id', 'workspace_path', 'file_path', 'source', 'before_code',
+        'after_code', 'notes', 'timestamp', 'tags', 'prompt_id', 'modelInfo', 'type'
+    }),
+}
+
+
+@lru_cache(maxsize=256)
+def _compile(query: str):
+    """Build the SQLAlchemy text() clause once per distinct statement"""
+    return text(query)
+
+
+def _release_connection(connections: list, lock, conn):
+    """Finalizer: untrack and close a connection whose thread has exited"""
+    with lock:
+        try:
+            connections.remove(conn)
+        except ValueError:
+            # Already released by close()
+            return
+    conn.close()
+
+
+class _ThreadConnection:
+    """One thread's connection, held only by that thread's local storage"""
+    __slots__ = ('conn', '__weakref__')
+    
+    def __init__(self, conn):
+        self.conn = conn
+
+
 class DatabaseConnector:
     """Connects to companion service database (SQLite or PostgreSQL)"""
     
-    def __init__(self):
+    _shared = None
+    _shared_lock = threading.Lock()
+    
+    def __init__(self, create_indexes: bool = False):
         self.db_type = config.DATABASE_TYPE
         self.engine = None
-        self.sqlite_conn = None
+        self.db_path = None
+        # Connections are opened lazily per thread: sqlite3 and SQLAlchemy
+        # connections must not be shared between threads
+        self._local = threading.local()
+        self._connections = []
+        # Reentrant: a finalizer may release a connection during garbage
+        # collection on a thread that already holds the lock
+        self._connections_lock = threading.RLock()
         
         if self.db_type == 'postgres':
             if not config.DATABASE_URL:
@@ -26,78 +103,233 @@ class DatabaseConnector:
             self.engine = create_engine(config.DATABASE_URL)
         else:
             # SQLite
-            db_path = config.DATABASE_PATH
-            if not os.path.exists(db_path):
-                raise FileNotFoundError(f"Database not found: {db_path}")
-            self.sqlite_conn = sqlite3.connect(db_path)
-            self.sqlite_conn.row_factory = sqlite3.Row
+            self.db_path = config.DATABASE_PATH
+            if not os.path.exists(self.db_path):
+                raise FileNotFoundError(f"Database not found: {self.db_path}")
+            if create_indexes:
+                self._ensure_indexes()
+    
+    @classmethod
+    def get_shared(cls) -> 'DatabaseConnector':
+        """Process-wide connector, created on first use"""
+        with cls._shared_lock:
+            if cls._shared is None:
+                cls._shared = cls()
+            return cls._shared
     
-    def execute_query(self, query: str, params: tuple = ()) -> List[Dict]:
+    @classmethod
+    def close_shared(cls):
+        """Close and forget the process-wide connector"""
+        with cls._shared_lock:
+            if cls._shared is not None:
+                cls._shared.close()
+                cls._shared = None
+    
+    def _track(self, conn) -> _ThreadConnection:
+        """Remember a per-thread connection so close() can release it
+        
+        The returned holder lives only in the thread's local storage, so when
+        a short-lived worker thread exits the holder is collected and its
+        connection is closed instead of lingering until close().
+        """
+        holder = _ThreadConnection(conn)
+        with self._connections_lock:
+            self._connections.append(conn)
+        weakref.finalize(holder, _release_connection, self._connections, self._connections_lock, conn)
+        return holder
+    
+    @property
+    def sqlite_conn(self) -> Optional[sqlite3.Connection]:
+        """This thread's SQLite connection (None for PostgreSQL)"""
+        if self.db_type == 'postgres':
+            return None
+        holder = getattr(self._local, 'sqlite_conn', None)
+        if holder is None:
+            # Autocommit mode; multi-query reads opt into read_transaction().
+            # Each connection is only used by its own thread; the check is
+            # relaxed so close() may run from any thread.
+            conn = sqlite3.connect(self.db_path, isolation_level=None, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            self._configure_sqlite(conn)
+            holder = self._local.sqlite_conn = self._track(conn)
+        return holder.conn
+    
+    @property
+    def pg_conn(self):
+        """This thread's PostgreSQL connection, held for the thread's lifetime"""
+        if self.db_type != 'postgres':
+            return None
+        holder = getattr(self._local, 'pg_conn', None)
+        if holder is None:
+            holder = self._local.pg_conn = self._track(self.engine.connect())
+        return holder.conn
+    
+    def _configure_sqlite(self, conn: sqlite3.Connection):
+        """Apply read-optimized pragmas (mirrors the companion service settings)"""
+        try:
+            conn.executescript("""
+                PRAGMA journal_mode=WAL;
+                PRAGMA synchronous=NORMAL;
+                PRAGMA temp_store=MEMORY;
+                PRAGMA cache_size=-64000;
+                PRAGMA mmap_size=268435456;
+            """)
+        except sqlite3.Error as e:
+            print(f"[WARNING] Could not apply SQLite pragmas: {e}", file=sys.stderr)
+    
+    def _ensure_indexes(self):
+        """Ensure indexes used by the connector's queries exist (SQLite)
+        
+        Opt-in via create_indexes=True: the companion service creates the
+        same indexes, and DDL needs the write lock a reader shouldn't wait on.
+        """
+        # Same names and definitions as the companion service so existing
+        # indexes are reused rather than duplicated
+        conn = self.sqlite_conn
+        try:
+            # Give up quickly if the companion holds the write lock
+            conn.execute(f'PRAGMA busy_timeout={INDEX_BUSY_TIMEOUT_MS}')
+            conn.executescript("""
+                CREATE INDEX IF NOT EXISTS idx_entries_timestamp ON entries(timestamp);
+                CREATE INDEX IF NOT EXISTS idx_entries_prompt_id ON entries(prompt_id);
+                CREATE INDEX IF NOT EXISTS idx_entries_workspace_timestamp ON entries(workspace_path, timestamp DESC);
+                CREATE INDEX IF NOT EXISTS idx_prompts_workspace_timestamp ON prompts(workspace_path, timestamp DESC);
+                CREATE INDEX IF NOT EXISTS idx_events_workspace_timestamp ON events(workspace_path, timestamp DESC);
+            """)
+        except sqlite3.Error as e:
+            # Read-only, locked or partially migrated databases are still queryable
+            print(f"[WARNING] Could not ensure database indexes: {e}", file=sys.stderr)
+        finally:
+            conn.execute(f'PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}')
+    
+    def execute_query(self, query: str, params: QueryParams = ()) -> List[Dict]:
         """Execute query and return results as list of dictionaries"""
+        return list(self.iter_query(query, params))
+    
+    def iter_query(self, query: str, params: QueryParams = (), chunk_size: int = 1024) -> Iterator[Dict]:
+        """Execute query and yield results as dictionaries, fetching in chunks
+        
+        Only one chunk of raw rows is held at a time, so callers that reduce
+        rows as they go never materialize the whole result set twice.
+        """
+        # Local bindings keep the per-row dict construction on LOAD_FAST
+        dict_ = dict
+        zip_ = zip
         if self.db_type == 'postgres':
-            with self.engine.connect() as conn:
-                result = conn.execute(text(query), params)
-                columns = result.keys()
-                return [dict(zip(columns, row)) for row in result]
+            try:
+                result = self.pg_conn.execution_options(stream_results=True).execute(
+                    _compile(query), params
+                )
+                columns = tuple(result.keys())
+                while True:
+                    chunk = result.fetchmany(chunk_size)
+                    if not chunk:
+                        break
+                    for row in chunk:
+                        yield dict_(zip_(columns, row))
+            finally:
+                # End the implicit read transaction so the connection isn't
+                # left idle in transaction between queries
+                self.pg_conn.rollback()
         else:
-            # SQLite
-            cursor = self.sqlite_conn.execute(query, params)
-            columns = [desc[0] for desc in cursor.description]
-            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+            # SQLite - plain tuples are cheaper to build than sqlite3.Row here
+            cursor = self.sqlite_conn.cursor()
+            cursor.row_factory = None
+            cursor.execute(query, params)
+            columns = tuple(desc[0] for desc in cursor.description)
+            while True:
+                chunk = cursor.fetchmany(chunk_size)
+                if not chunk:
+                    break
+                for row in chunk:
+                    yield dict_(zip_(columns, row))
     
-    def get_events(self, workspace_path: Optional[str] = None, 
-                   limit: Optional[int] = None,
-                   order_by: str = 'timestamp ASC') -> List[Dict]:
-        """Get events from database"""
-        query = "SELECT * FROM events WHERE 1=1"
-        params = []
+    def execute_query_rows(self, query: str, params: QueryParams = ()) -> Iterable:
+        """Execute query and return rows supporting row['column'] access
         
-        if workspace_path:
-            query += " AND workspace_path = ?"
-            params.append(workspace_path)
+        Avoids building a dict per row for callers that only index columns.
+        """
+        if self.db_type == 'postgres':
+            try:
+                return self.pg_conn.execute(_compile(query), params).mappings().all()
+            finally:
+                self.pg_conn.rollback()
+        else:
+            # SQLite cursor yields sqlite3.Row lazily
+            return self.sqlite_conn.execute(query, params)
+    
+    @contextmanager
+    def read_transaction(self):
+        """Hold a single shared read lock across several queries (SQLite)
         
-        query += f" ORDER BY {order_by}"
+        Nested calls on the same thread join the outermost transaction; only
+        that level issues BEGIN and COMMIT.
+        """
+        if self.db_type == 'postgres':
+            yield
+            return
+        conn = self.sqlite_conn
+        depth = getattr(self._local, 'read_depth', 0)
+        if depth == 0:
+            conn.execute('BEGIN DEFERRED')
+        self._local.read_depth = depth + 1
+        try:
+            yield
+        finally:
+            self._local.read_depth = depth
+            if depth == 0:
+                conn.execute('COMMIT')
+    
+    def _select_table(self, table: str, workspace_path: Optional[str],
+                      limit: Optional[int], order_by: str,
+                      columns: Sequence[str] = ('*',)) -> List[Dict]:
+        """Select rows from a table with bound workspace/limit parameters
         
-        if limit:
-            query += f" LIMIT {limit}"
+        Keeping the SQL text stable per (table, filters) lets SQLite reuse its
+        cached statement and walk the (workspace_path, timestamp) index.
+        """
+        if order_by not in ORDER_BY_CLAUSES:
+            raise ValueError(f"Unsupported order_by: {order_by}")
+        if tuple(columns) != ('*',):
+            unknown = [c for c in columns if c not in TABLE_COLUMNS[table]]
+            if unknown or not columns:
+                raise ValueError(f"Unsupported {table} columns: {unknown or columns}")
         
-        return self.execute_query(query, tuple(params))
-    
-    def get_prompts(self, workspace_path: Optional[str] = None,
-                   limit: Optional[int] = None,
-                   order_by: str = 'timestamp ASC') -> List[Dict]:
-        """Get prompts from database"""
-        query = "SELECT * FROM prompts WHERE 1=1"
-        params = []
+        query = f"SELECT {', '.join(columns)} FROM {table} WHERE 1=1"
+        params = {}
         
         if workspace_path:
-            query += " AND workspace_path = ?"
-            params.append(workspace_path)
+            query += " AND workspace_path = :workspace_path"
+            params['workspace_path'] = workspace_path
         
         query += f" ORDER BY {order_by}"
         
         if limit:
-            query += f" LIMIT {limit}"
+            query += " LIMIT :limit"
+            params['limit'] = int(limit)
         
-        return self.execute_query(query, tuple(params))
+        return self.execute_query(query, params)
+    
+    def get_events(self, workspace_path: Optional[str] = None, 
+                   limit: Optional[int] = None,
+                   order_by: str = 'timestamp ASC',
+                   columns: Sequence[str] = ('*',)) -> List[Dict]:
+        """Get events from database"""
+        return self._select_table('events', workspace_path, limit, order_by, columns)
+    
+    def get_prompts(self, workspace_path: Optional[str] = None,
+                   limit: Optional[int] = None,
+                   order_by: str = 'timestamp ASC',
+                   columns: Sequence[str] = ('*',)) -> List[Dict]:
+        """Get prompts from database"""
+        return self._select_table('prompts', workspace_path, limit, order_by, columns)
     
     def get_entries(self, workspace_path: Optional[str] = None,
                    limit: Optional[int] = None,
-                   order_by: str = 'timestamp ASC') -> List[Dict]:
+                   order_by: str = 'timestamp ASC',
+                   columns: Sequence[str] = ('*',)) -> List[Dict]:
         """Get entries (file changes) from database"""
-        query = "SELECT * FROM entries WHERE 1=1"
-        params = []
-        
-        if workspace_path:
-            query += " AND workspace_path = ?"
-            params.append(workspace_path)
-        
-        query += f" ORDER BY {order_by}"
-        
-        if limit:
-            query += f" LIMIT {limit}"
-        
-        return self.execute_query(query, tuple(params))
+        return self._select_table('entries', workspace_path, limit, order_by, columns)
     
     def get_events_with_prompts(self, workspace_path: Optional[str] = None,
                                limit: Optional[int] = None) -> List[Dict]:
@@ -127,71 +359,127 @@ class DatabaseConnector:
                 WHERE 1=1
             """
         
-        params = []
+        params = {}
         if workspace_path:
-            query += " AND e.workspace_path = ?"
-            params.append(workspace_path)
+            query += " AND e.workspace_path = :workspace_path"
+            params['workspace_path'] = workspace_path
         
         query += " ORDER BY e.timestamp ASC"
         
         if limit:
-            query += f" LIMIT {limit}"
+            query += " LIMIT :limit"
+            params['limit'] = int(limit)
         
-        return self.execute_query(query, tuple(params))
+        return self.execute_query(query, params)
     
     def get_entries_for_prompt(self, prompt_id: int, 
                                time_window_seconds: int = 300) -> List[Dict]:
         """Get entries (file changes) associated with a prompt within time window"""
-        # Get prompt timestamp
-        prompt_query = "SELECT timestamp FROM prompts WHERE id = ?"
-        prompt_result = self.execute_query(prompt_query, (prompt_id,))
-        
-        if not prompt_result:
-            return []
+        # The prompt row is joined in so its timestamp never round-trips
+        # through Python; the window is computed by the database
+        if self.db_type == 'postgres':
+            query = """
+                SELECT e.file_path
+                FROM prompts p
+                JOIN entries e
+                    ON e.prompt_id = p.id
+                    OR CAST(e.timestamp AS TIMESTAMPTZ) BETWEEN
+                        CAST(p.timestamp AS TIMESTAMPTZ) - make_interval(secs => :window)
+                        AND CAST(p.timestamp AS TIMESTAMPTZ) + make_interval(secs => :window)
+                WHERE p.id = :prompt_id
+                    AND e.file_path IS NOT NULL
+                    AND (e.before_code != e.after_code OR e.before_code IS NULL)
+            """
+        else:
+            # Bounds use the stored ISO layout so entries(timestamp) stays usable
+            query = """
+                SELECT e.file_path
+                FROM prompts p
+                JOIN entries e
+                    ON e.prompt_id = p.id
+                    OR (e.timestamp >= strftime('%Y-%m-%dT%H:%M:%f', p.timestamp, :window_start)
+                        AND e.timestamp <= strftime('%Y-%m-%dT%H:%M:%f', p.timestamp, :window_end))
+                WHERE p.id = :prompt_id
+                    AND e.file_path IS NOT NULL
+                    AND (e.before_code != e.after_code OR e.before_code IS NULL)
+            """
+        rows = self.execute_query_rows(query, {
+            'prompt_id': prompt_id,
+            'window': time_window_seconds,
+            'window_start': f'-{time_window_seconds} seconds',
+            'window_end': f'+{time_window_seconds} seconds'
+        })
+        # Deduplicate here rather than with DISTINCT, which makes the
+        # database sort/hash the whole result first
+        return [{'file_path': f} for f in dict.fromkeys(row['file_path'] for row in rows)]
+    
+    def get_entries_for_prompts(self, prompt_ids: List[int],
+                                time_window_seconds: int = 300) -> Dict[int, List[str]]:
+        """Get changed file paths for many prompts in one query per batch
         
-        prompt_time = prompt_result[0]['timestamp']
+        Returns a mapping of prompt_id -> file paths, computing each prompt's
+        time window inside the database instead of per prompt in Python.
+        """
+        # Ordered per-prompt sets; duplicates are dropped here instead of
+        # with DISTINCT in SQL
+        seen = defaultdict(dict)
+        if not prompt_ids:
+            return defaultdict(list)
         
-        # Calculate time window
         if self.db_type == 'postgres':
             query = """
-                SELECT DISTINCT file_path
-                FROM entries
-                WHERE (prompt_id = :prompt_id 
-                    OR timestamp BETWEEN 
-                        (SELECT timestamp FROM prompts WHERE id = :prompt_id) - INTERVAL ':window seconds'
-                        AND (SELECT timestamp FROM prompts WHERE id = :prompt_id) + INTERVAL ':window seconds')
-                    AND file_path IS NOT NULL
-                    AND (before_code != after_code OR before_code IS NULL)
+                SELECT p.id AS prompt_id, e.file_path
+                FROM prompts p
+                JOIN entries e
+                    ON e.prompt_id = p.id
+                    OR CAST(e.timestamp AS TIMESTAMPTZ) BETWEEN
+                        CAST(p.timestamp AS TIMESTAMPTZ) - make_interval(secs => :window)
+                        AND CAST(p.timestamp AS TIMESTAMPTZ) + make_interval(secs => :window)
+                WHERE p.id = ANY(:prompt_ids)
+                    AND e.file_path IS NOT NULL
+                    AND (e.before_code != e.after_code OR e.before_code IS NULL)
             """
-            return self.execute_query(query, {
-                'prompt_id': prompt_id,
+            rows = self.execute_query_rows(query, {
+                'prompt_ids': list(prompt_ids),
                 'window': time_window_seconds
             })
+            for row in rows:
+                seen[row['prompt_id']][row['file_path']] = None
         else:
-            # SQLite - use datetime arithmetic
-            from datetime import datetime, timedelta
-            try:
-                prompt_dt = datetime.fromisoformat(prompt_time.replace('Z', '+00:00'))
-            except:
-                # Fallback parsing
-                prompt_dt = datetime.strptime(prompt_time.split('.')[0], '%Y-%m-%dT%H:%M:%S')
-            
-            window_start = (prompt_dt - timedelta(seconds=time_window_seconds)).isoformat()
-            window_end = (prompt_dt + timedelta(seconds=time_window_seconds)).isoformat()
-            
-            query = """
-                SELECT DISTINCT file_path
-                FROM entries
-                WHERE (prompt_id = ? OR (timestamp >= ? AND timestamp <= ?))
-                    AND file_path IS NOT NULL
-                    AND (before_code != after_code OR before_code IS NULL)
-            """
-            return self.execute_query(query, (prompt_id, window_start, window_end))
+            # SQLite caps bound parameters per statement, so batch the IN list.
+            # Window bounds are rendered in the same ISO layout as stored
+            # timestamps so the entries(timestamp) index stays usable.
+            window_start = f'-{time_window_seconds} seconds'
+            window_end = f'+{time_window_seconds} seconds'
+            batch_size = 500
+            for i in range(0, len(prompt_ids), batch_size):
+                batch = prompt_ids[i:i + batch_size]
+                placeholders = ','.join('?' * len(batch))
+                query = f"""
+                    SELECT p.id AS prompt_id, e.file_path
+                    FROM prompts p
+                    JOIN entries e
+                        ON e.prompt_id = p.id
+                        OR (e.timestamp >= strftime('%Y-%m-%dT%H:%M:%f', p.timestamp, ?)
+                            AND e.timestamp <= strftime('%Y-%m-%dT%H:%M:%f', p.timestamp, ?))
+                    WHERE p.id IN ({placeholders})
+                        AND e.file_path IS NOT NULL
+                        AND (e.before_code != e.after_code OR e.before_code IS NULL)
+                """
+                for row in self.execute_query_rows(query, (window_start, window_end, *batch)):
+                    seen[row['prompt_id']][row['file_path']] = None
+        
+        return defaultdict(list, ((prompt_id, list(paths)) for prompt_id, paths in seen.items()))
     
     def close(self):
         """Close database connections"""
-        if self.sqlite_conn:
-            self.sqlite_conn.close()
+        with self._connections_lock:
+            # Emptied in place so pending finalizers find nothing to release
+            connections = list(self._connections)
+            self._connections.clear()
+        for conn in connections:
+            conn.close()
+        self._local = threading.local()
         if self.engine:
             self.engine.dispose()
 
@@ -0,0 +1,151 @@
+"""
+Banded Dynamic Time Warping
+Numba-compiled Sakoe-Chiba DTW and DBA k-means for sequence clustering
+"""
+
+import numpy as np
+from numba import njit, prange
+
+
+@njit(cache=True)
+def _band_offsets(n, m, window):
+    """Columns allowed below/above the diagonal for each row of an (n, m) grid
+    
+    Same band as tslearn's sakoe_chiba_mask: the side of the longer series is
+    widened by the length difference so the end cell stays reachable.
+    """
+    return window + max(n - m, 0), window + max(m - n, 0)
+
+
+@njit(cache=True)
+def dtw_distance(x, y, window):
+    """DTW distance between two (L, D) series within a Sakoe-Chiba band"""
+    n = x.shape[0]
+    m = y.shape[0]
+    below, above = _band_offsets(n, m, window)
+    
+    # Two rolling rows of the accumulated cost matrix: O(L) memory
+    prev = np.full(m + 1, np.inf)
+    curr = np.full(m + 1, np.inf)
+    prev[0] = 0.0
+    
+    for i in range(1, n + 1):
+        curr[:] = np.inf
+        for j in range(max(1, i - below), min(m, i + above) + 1):
+            cost = 0.0
+            for k in range(x.shape[1]):
+                diff = x[i - 1, k] - y[j - 1, k]
+                cost += diff * diff
+            best = prev[j - 1]
+            if prev[j] < best:
+                best = prev[j]
+            if curr[j - 1] < best:
+                best = curr[j - 1]
+            curr[j] = cost + best
+        prev, curr = curr, prev
+    
+    return np.sqrt(prev[m])
+
+
+@njit(parallel=True, cache=True)
+def dtw_cross(X, Y, window):
+    """Pairwise banded DTW distances between (n, L, D) and (m, L, D) stacks"""
+    out = np.empty((X.shape[0], Y.shape[0]))
+    for i in prange(X.shape[0]):
+        for j in range(Y.shape[0]):
+            out[i, j] = dtw_distance(X[i], Y[j], window)
+    return out
+
+
+@njit(cache=True)
+def _dtw_path(x, y, window):
+    """Optimal banded warping path as (x indices, y indices)"""
+    n = x.shape[0]
+    m = y.shape[0]
+    below, above = _band_offsets(n, m, window)
+    
+    acc = np.full((n + 1, m + 1), np.inf)
+    acc[0, 0] = 0.0
+    for i in range(1, n + 1):
+        for j in range(max(1, i - below), min(m, i + above) + 1):
+            cost = 0.0
+            for k in range(x.shape[1]):
+                diff = x[i - 1, k] - y[j - 1, k]
+                cost += diff * diff
+            acc[i, j] = cost + min(acc[i - 1, j - 1], acc[i - 1, j], acc[i, j - 1])
+    
+    # Backtrack from the end of both series
+    path_x = np.empty(n + m, dtype=np.int64)
+    path_y = np.empty(n + m, dtype=np.int64)
+    i = n
+    j = m
+    k = 0
+    while i > 0 and j > 0:
+        path_x[k] = i - 1
+        path_y[k] = j - 1
+        k += 1
+        diag = acc[i - 1, j - 1]
+        up = acc[i - 1, j]
+        left = acc[i, j - 1]
+        if diag <= up and diag <= left:
+            i -= 1
+            j -= 1
+        elif up <= left:
+            i -= 1
+        else:
+            j -= 1
+    
+    return path_x[:k], path_y[:k]
+
+
+@njit(cache=True)
+def dba_update(center, members, window):
+    """One DTW Barycenter Averaging step for a cluster center"""
+    length, dim = center.shape
+    # Accumulate in float64; the returned center keeps the input dtype
+    sums = np.zeros((length, dim))
+    counts = np.zeros(length)
+    
+    # Average the member frames aligned to each center frame
+    for s in range(members.shape[0]):
+        path_c, path_m = _dtw_path(center, members[s], window)
+        for k in range(path_c.shape[0]):
+            t = path_c[k]
+            for d in range(dim):
+                sums[t, d] += members[s, path_m[k], d]
+            counts[t] += 1.0
+    
+    out = center.copy()
+    for t in range(length):
+        if counts[t] > 0:
+            for d in range(dim):
+                out[t, d] = sums[t, d] / counts[t]
+    return out
+
+
+def dtw_kmeans(X, n_clusters, window, max_iter=10, random_state=42):
+    """k-means under banded DTW with DBA centers
+    
+    X is an (n, L, D) stack of equal-length series. Returns (labels, centers).
+    """
+    X = np.ascontiguousarray(X, dtype=np.float32)
+    n = X.shape[0]
+    n_clusters = min(n_clusters, n)
+    
+    rng = np.random.RandomState(random_state)
+    centers = X[rng.choice(n, n_clusters, replace=False)].copy()
+    labels = np.full(n, -1, dtype=np.int64)
+    
+    for _ in range(max_iter):
+        new_labels = dtw_cross(X, centers, window).argmin(axis=1)
+        if np.array_equal(new_labels, labels):
+            break
+        labels = new_labels
+        
+        for c in range(n_clusters):
+            members = X[labels == c]
+            # Empty clusters keep their previous center
+            if members.shape[0]:
+                centers[c] = dba_update(centers[c], members, window)
+    
+    return labels, centers
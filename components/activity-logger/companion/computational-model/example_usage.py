@@ -14,21 +14,18 @@ def example_1_get_events():
     """Example: Get events from database"""
     print("Example 1: Getting events from database")
     
-    db = DatabaseConnector()
-    try:
-        events = db.get_events(limit=10)
-        print(f"Found {len(events)} events")
-        for event in events[:3]:
-            print(f"  - {event.get('type')} at {event.get('timestamp')}")
-    finally:
-        db.close()
+    db = DatabaseConnector.get_shared()
+    events = db.get_events(limit=10)
+    print(f"Found {len(events)} events")
+    for event in events[:3]:
+        print(f"  - {event.get('type')} at {event.get('timestamp')}")
 
 
 def example_2_vectorize():
     """Example: Vectorize events"""
     print("\nExample 2: Vectorizing events")
     
-    db = DatabaseConnector()
+    db = DatabaseConnector.get_shared()
     vectorizer = EventVectorizer()
     
     try:
@@ -39,9 +36,9 @@ def example_2_vectorize():
             vectorized = vectorizer.vectorize_event(event)
             print(f"  Event: {event.get('type')}")
             print(f"    Vector dim: {len(vectorized['combined_vector'])}")
-            print(f"    Event type vector: {vectorized['event_type_vector']}")
+            print(f"    Event type index: {vectorized['event_type_idx']}")
     finally:
-        db.close()
+        vectorizer.close()
 
 
 def example_3_calculate_cp():
@@ -50,22 +47,19 @@ def example_3_calculate_cp():
     
     from scripts.calculate_cp import calculate_cp, extract_context_files
     
-    db = DatabaseConnector()
-    try:
-        prompts = db.get_prompts(limit=5)
+    db = DatabaseConnector.get_shared()
+    prompts = db.get_prompts(limit=5)
+    
+    for prompt in prompts[:2]:
+        prompt_id = prompt.get('id')
+        diff_files_data = db.get_entries_for_prompt(prompt_id, time_window_seconds=300)
+        diff_files = [e.get('file_path') for e in diff_files_data if e.get('file_path')]
         
-        for prompt in prompts[:2]:
-            prompt_id = prompt.get('id')
-            diff_files_data = db.get_entries_for_prompt(prompt_id, time_window_seconds=300)
-            diff_files = [e.get('file_path') for e in diff_files_data if e.get('file_path')]
-            
-            cp_result = calculate_cp(prompt, diff_files)
-            print(f"  Prompt {prompt_id}:")
-            print(f"    CP: {cp_result['cp']:.2f}")
-            print(f"    Context files: {cp_result['context_file_count']}")
-            print(f"    Diff files: {cp_result['diff_file_count']}")
-    finally:
-        db.close()
+        cp_result = calculate_cp(prompt, diff_files)
+        print(f"  Prompt {prompt_id}:")
+        print(f"    CP: {cp_result['cp']:.2f}")
+        print(f"    Context files: {cp_result['context_file_count']}")
+        print(f"    Diff files: {cp_result['diff_file_count']}")
 
 
 def example_4_build_library():
@@ -73,7 +67,7 @@ def example_4_build_library():
     print("\nExample 4: Building behavioral library")
     print("  (This may take a while with real data)")
     
-    processor = SequenceProcessor()
+    processor = SequenceProcessor(db=DatabaseConnector.get_shared())
     try:
         # Use a small workspace or limit sequences for demo
         library = processor.build_behavioral_library(workspace_path=None)
@@ -101,7 +95,10 @@ if __name__ == '__main__':
         }
         
         if example_num in examples:
-            examples[example_num]()
+            try:
+                examples[example_num]()
+            finally:
+                DatabaseConnector.close_shared()
         else:
             print(f"Unknown example: {example_num}")
             print("Available examples: 1, 2, 3, 4")
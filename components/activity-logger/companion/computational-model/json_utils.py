@@ -0,0 +1,28 @@
+"""
+JSON Helpers
+orjson-backed encoding and decoding with a stdlib json fallback
+"""
+
+import json
+
+try:
+    import orjson
+    HAS_ORJSON = True
+except ImportError:
+    HAS_ORJSON = False
+
+# orjson returns bytes from dumps and accepts bytes or str in loads
+if HAS_ORJSON:
+    json_dumps = orjson.dumps
+    json_loads = orjson.loads
+else:
+    json_dumps = json.dumps
+    json_loads = json.loads
+
+
+def json_dumps_indented(obj, default=None) -> bytes:
+    """Serialize to indented JSON bytes (orjson if available)"""
+    if HAS_ORJSON:
+        return orjson.dumps(obj, default=default,
+                            option=orjson.OPT_INDENT_2 | orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(obj, indent=2, default=default).encode('utf-8')
@@ -5,8 +5,8 @@ Performs statistical significance tests on control vs treatment groups
 """
 
 import sys
-import json
 import argparse
+from operator import itemgetter
 from pathlib import Path
 from typing import Dict, List
 
@@ -22,10 +22,28 @@ except ImportError:
 
 import numpy as np
 
+from json_utils import json_loads, json_dumps_indented
 
-def calculate_metrics(data: List[Dict]) -> Dict:
-    """Calculate metrics from data points"""
-    if not data:
+
+_get_value = itemgetter('value')
+
+
+def _extract_values(data: List[Dict]) -> np.ndarray:
+    """Values of the data points that carry one, as a float64 array"""
+    return np.fromiter((_get_value(d) for d in data if 'value' in d), dtype=np.float64)
+
+
+def _sample_values(data: List[Dict], values: np.ndarray) -> np.ndarray:
+    """t-test sample for data points, counting points without a value as 0"""
+    if values.size == len(data):
+        # Every point has a value, so the metric array is already the sample
+        return values
+    return np.fromiter((d.get('value', 0) for d in data), dtype=np.float64, count=len(data))
+
+
+def _metrics_from_values(arr: np.ndarray) -> Dict:
+    """Summary statistics for an array of values"""
+    if not arr.size:
         return {
             'mean': 0.0,
             'median': 0.0,
@@ -35,61 +53,64 @@ def calculate_metrics(data: List[Dict]) -> Dict:
             'max': 0.0
         }
     
-    values = [d.get('value', 0) for d in data if 'value' in d]
+    return {
+        'mean': float(arr.mean()),
+        'median': float(np.median(arr)),
+        'std': float(arr.std()),
+        'count': int(arr.size),
+        'min': float(arr.min()),
+        'max': float(arr.max())
+    }
+
+
+def calculate_metrics(data: List[Dict]) -> Dict:
+    """Calculate metrics from data points"""
+    return _metrics_from_values(_extract_values(data) if data else np.empty(0))
+
+
+def _mean_difference(control: List[float], treatment: List[float]):
+    """Convert both samples once and compare their means"""
+    c = np.asarray(control, dtype=np.float64)
+    t = np.asarray(treatment, dtype=np.float64)
     
-    if not values:
-        return {
-            'mean': 0.0,
-            'median': 0.0,
-            'std': 0.0,
-            'count': 0,
-            'min': 0.0,
-            'max': 0.0
-        }
+    control_mean = c.mean()
+    treatment_mean = t.mean()
+    diff = treatment_mean - control_mean
+    percent_change = (diff / control_mean * 100) if control_mean != 0 else 0.0
+    
+    return c, t, control_mean, treatment_mean, diff, percent_change
+
+
+def _t_test_basic(control: List[float], treatment: List[float]) -> Dict:
+    """Compare group means without a significance test (scipy unavailable)"""
+    _, _, control_mean, treatment_mean, diff, percent_change = _mean_difference(control, treatment)
     
     return {
-        'mean': float(np.mean(values)),
-        'median': float(np.median(values)),
-        'std': float(np.std(values)),
-        'count': len(values),
-        'min': float(np.min(values)),
-        'max': float(np.max(values))
+        'control_mean': float(control_mean),
+        'treatment_mean': float(treatment_mean),
+        'difference': float(diff),
+        'percent_change': float(percent_change),
+        'p_value': None,
+        'significant': None,
+        'note': 'scipy not available for significance testing'
     }
 
 
-def t_test(control: List[float], treatment: List[float]) -> Dict:
+def _t_test_scipy(control: List[float], treatment: List[float]) -> Dict:
     """Perform independent samples t-test"""
-    if not HAS_SCIPY:
-        # Basic comparison without significance test
-        control_mean = np.mean(control)
-        treatment_mean = np.mean(treatment)
-        diff = treatment_mean - control_mean
-        percent_change = (diff / control_mean * 100) if control_mean != 0 else 0.0
-        
-        return {
-            'control_mean': float(control_mean),
-            'treatment_mean': float(treatment_mean),
-            'difference': float(diff),
-            'percent_change': float(percent_change),
-            'p_value': None,
-            'significant': None,
-            'note': 'scipy not available for significance testing'
-        }
+    c, t, control_mean, treatment_mean, diff, percent_change = _mean_difference(control, treatment)
     
     # Perform t-test
-    t_stat, p_value = stats.ttest_ind(treatment, control)
+    t_stat, p_value = stats.ttest_ind(t, c)
     
-    # Calculate effect size (Cohen's d)
+    # Calculate effect size (Cohen's d) from the variances of both samples
+    n_c = c.size
+    n_t = t.size
     pooled_std = np.sqrt(
-        ((len(control) - 1) * np.var(control) + (len(treatment) - 1) * np.var(treatment)) /
-        (len(control) + len(treatment) - 2)
+        ((n_c - 1) * c.var() + (n_t - 1) * t.var()) /
+        (n_c + n_t - 2)
     )
-    cohens_d = (np.mean(treatment) - np.mean(control)) / pooled_std if pooled_std > 0 else 0.0
-    
-    control_mean = np.mean(control)
-    treatment_mean = np.mean(treatment)
-    diff = treatment_mean - control_mean
-    percent_change = (diff / control_mean * 100) if control_mean != 0 else 0.0
+    cohens_d = diff / pooled_std if pooled_std > 0 else 0.0
     
     return {
         'control_mean': float(control_mean),
@@ -99,11 +120,26 @@ def t_test(control: List[float], treatment: List[float]) -> Dict:
         't_statistic': float(t_stat),
         'p_value': float(p_value),
         'cohens_d': float(cohens_d),
-        'significant': p_value < 0.05,
+        'significant': bool(p_value < 0.05),
         'confidence_level': '95%'
     }
 
 
+# Implementation chosen once at import instead of branching per call
+t_test = _t_test_scipy if HAS_SCIPY else _t_test_basic
+
+
+def _analyze_metric(control_points: List[Dict], treatment_points: List[Dict]):
+    """t-test plus per-group metrics, walking each group's data points once"""
+    control_values = _extract_values(control_points)
+    treatment_values = _extract_values(treatment_points)
+    analysis = t_test(
+        _sample_values(control_points, control_values),
+        _sample_values(treatment_points, treatment_values)
+    )
+    return analysis, _metrics_from_values(control_values), _metrics_from_values(treatment_values)
+
+
 def analyze_ab_test(control_data: Dict, treatment_data: Dict) -> Dict:
     """Analyze A/B test results"""
     # Extract metrics
@@ -112,21 +148,17 @@ def analyze_ab_test(control_data: Dict, treatment_data: Dict) -> Dict:
     
     # Time to completion
     if 'time_to_completion' in control_data and 'time_to_completion' in treatment_data:
-        control_times = [d.get('value', 0) for d in control_data['time_to_completion']]
-        treatment_times = [d.get('value', 0) for d in treatment_data['time_to_completion']]
-        time_analysis = t_test(control_times, treatment_times)
-        control_metrics['time_to_completion'] = calculate_metrics(control_data['time_to_completion'])
-        treatment_metrics['time_to_completion'] = calculate_metrics(treatment_data['time_to_completion'])
+        time_analysis, control_metrics['time_to_completion'], treatment_metrics['time_to_completion'] = _analyze_metric(
+            control_data['time_to_completion'], treatment_data['time_to_completion']
+        )
     else:
         time_analysis = None
     
     # Context Precision
     if 'context_precision' in control_data and 'context_precision' in treatment_data:
-        control_cp = [d.get('value', 0) for d in control_data['context_precision']]
-        treatment_cp = [d.get('value', 0) for d in treatment_data['context_precision']]
-        cp_analysis = t_test(control_cp, treatment_cp)
-        control_metrics['context_precision'] = calculate_metrics(control_data['context_precision'])
-        treatment_metrics['context_precision'] = calculate_metrics(treatment_data['context_precision'])
+        cp_analysis, control_metrics['context_precision'], treatment_metrics['context_precision'] = _analyze_metric(
+            control_data['context_precision'], treatment_data['context_precision']
+        )
     else:
         cp_analysis = None
     
@@ -183,10 +215,10 @@ def main():
     
     # Load data
     if args.input:
-        with open(args.input, 'r') as f:
-            data = json.load(f)
+        with open(args.input, 'rb') as f:
+            data = json_loads(f.read())
     else:
-        data = json.load(sys.stdin)
+        data = json_loads(sys.stdin.buffer.read())
     
     # Extract control and treatment
     control_data = data.get('control', {})
@@ -200,13 +232,13 @@ def main():
     result = analyze_ab_test(control_data, treatment_data)
     
     # Output
-    output_json = json.dumps(result, indent=2)
+    output_json = json_dumps_indented(result)
     
     if args.output:
-        with open(args.output, 'w') as f:
+        with open(args.output, 'wb') as f:
             f.write(output_json)
     else:
-        print(output_json)
+        sys.stdout.buffer.write(output_json + b'\n')
 
 
 if __name__ == '__main__':
@@ -5,17 +5,57 @@ Calculates CP = |Context_documents ∩ Diff_documents| / |Context_documents|
 """
 
 import sys
-import json
 import argparse
+import importlib.util
+import numpy as np
+from functools import lru_cache
+from itertools import chain
 from pathlib import Path
-from typing import List, Dict
+from typing import List, Dict, Tuple
 
 # Add parent directory to path
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
 from database_connector import DatabaseConnector
+from json_utils import json_loads, json_dumps_indented
 import config
 
+# numba is imported only for batches big enough to repay its import and
+# kernel-load cost (several seconds on the first, compiling run)
+HAS_NUMBA = importlib.util.find_spec('numba') is not None
+
+# Context files per batch above which the Numba kernel beats np.isin
+NUMBA_MIN_CONTEXT_FILES = 500_000
+
+# Baseline CP distribution buckets
+CP_BUCKET_EDGES = np.array([0.0, 0.2, 0.4, 0.6, 0.8, 1.0])
+CP_BUCKET_LABELS = ('0.0-0.2', '0.2-0.4', '0.4-0.6', '0.6-0.8', '0.8-1.0')
+
+
+def _paths_from_context(context) -> Tuple[str, ...]:
+    """Collect file paths from a decoded context payload"""
+    files = []
+    
+    # Handle different context file formats
+    if isinstance(context, list):
+        files = [f if isinstance(f, str) else f.get('path') or f.get('fileName') for f in context]
+    elif isinstance(context, dict):
+        if 'attachedFiles' in context:
+            files = [f.get('path') or f.get('fileName') for f in context['attachedFiles']]
+        elif 'codebaseFiles' in context:
+            files = [f.get('path') or f.get('fileName') for f in context['codebaseFiles']]
+        elif 'files' in context:
+            files = [f if isinstance(f, str) else f.get('path') or f.get('fileName') for f in context['files']]
+    
+    # Filter out None/empty; interned so repeated paths compare by identity
+    return tuple(sys.intern(f) if type(f) is str else f for f in files if f)
+
+
+@lru_cache(maxsize=4096)
+def _parse_context_json(context_files_json) -> Tuple[str, ...]:
+    """Parse a raw context_files_json payload once; repeats hit the cache"""
+    return _paths_from_context(json_loads(context_files_json))
+
 
 def extract_context_files(prompt: Dict) -> List[str]:
     """Extract context file paths from prompt"""
@@ -24,53 +64,31 @@ def extract_context_files(prompt: Dict) -> List[str]:
         return []
     
     try:
-        if isinstance(context_files_json, str):
-            context = json.loads(context_files_json)
-        else:
-            context = context_files_json
-        
-        files = []
-        
-        # Handle different context file formats
-        if isinstance(context, list):
-            files = [f if isinstance(f, str) else f.get('path') or f.get('fileName') for f in context]
-        elif isinstance(context, dict):
-            if 'attachedFiles' in context:
-                files = [f.get('path') or f.get('fileName') for f in context['attachedFiles']]
-            elif 'codebaseFiles' in context:
-                files = [f.get('path') or f.get('fileName') for f in context['codebaseFiles']]
-            elif 'files' in context:
-                files = [f if isinstance(f, str) else f.get('path') or f.get('fileName') for f in context['files']]
-        
-        # Filter out None/empty
-        return [f for f in files if f]
+        if isinstance(context_files_json, (str, bytes)):
+            return list(_parse_context_json(context_files_json))
+        return list(_paths_from_context(context_files_json))
     except Exception as e:
         print(f"[CP] Error extracting context files: {e}", file=sys.stderr)
         return []
 
 
-def calculate_cp(prompt: Dict, diff_files: List[str]) -> Dict:
-    """Calculate Context Precision for a prompt"""
-    context_files = extract_context_files(prompt)
-    
-    if not context_files:
-        return {
-            'prompt_id': prompt.get('id'),
-            'cp': 0.0,
-            'context_file_count': 0,
-            'diff_file_count': len(diff_files),
-            'intersection_count': 0,
-            'context_files': [],
-            'diff_files': diff_files,
-            'unused_context_files': []
-        }
-    
-    # Calculate intersection
-    context_set = set(context_files)
-    diff_set = set(diff_files)
-    intersection = [f for f in context_files if f in diff_set]
-    unused = [f for f in context_files if f not in diff_set]
-    
+def _empty_cp_record(prompt: Dict, diff_files: List[str]) -> Dict:
+    """CP record for a prompt without context files"""
+    return {
+        'prompt_id': prompt.get('id'),
+        'cp': 0.0,
+        'context_file_count': 0,
+        'diff_file_count': len(diff_files),
+        'intersection_count': 0,
+        'context_files': [],
+        'diff_files': diff_files,
+        'unused_context_files': []
+    }
+
+
+def _build_cp_record(prompt: Dict, context_files: List[str], diff_files: List[str],
+                     intersection: List[str], unused: List[str]) -> Dict:
+    """CP record from a prompt's resolved context/diff intersection"""
     # Calculate CP
     cp = len(intersection) / len(context_files) if context_files else 0.0
     
@@ -88,28 +106,116 @@ def calculate_cp(prompt: Dict, diff_files: List[str]) -> Dict:
     }
 
 
-def calculate_baseline_cp(db: DatabaseConnector, workspace_path: str = None, limit: int = 1000) -> Dict:
-    """Calculate baseline CP for all prompts"""
-    prompts = db.get_prompts(workspace_path=workspace_path, limit=limit)
+def calculate_cp(prompt: Dict, diff_files: List[str]) -> Dict:
+    """Calculate Context Precision for a prompt"""
+    context_files = extract_context_files(prompt)
     
-    cp_scores = []
-    cp_records = []
+    if not context_files:
+        return _empty_cp_record(prompt, diff_files)
+    
+    # Calculate intersection
+    diff_set = set(diff_files)
+    intersection = [f for f in context_files if f in diff_set]
+    unused = [f for f in context_files if f not in diff_set]
+    
+    return _build_cp_record(prompt, context_files, diff_files, intersection, unused)
+
+
+def _context_hits(ctx_offsets, ctx_ids, diff_offsets, diff_ids) -> np.ndarray:
+    """Resolve context-in-diff membership for every prompt in the batch"""
+    if HAS_NUMBA and len(ctx_ids) >= NUMBA_MIN_CONTEXT_FILES:
+        from cp_kernel import context_hits_kernel
+        out_hits = np.zeros(len(ctx_ids), dtype=np.bool_)
+        context_hits_kernel(ctx_offsets, ctx_ids, diff_offsets, diff_ids, out_hits)
+        return out_hits
+    
+    # Key each (prompt, path) pair so one isin covers every prompt
+    n_prompts = len(ctx_offsets) - 1
+    stride = np.int64(max(ctx_ids.max(initial=0), diff_ids.max(initial=0)) + 1)
+    prompt_idx = np.arange(n_prompts, dtype=np.int64)
+    ctx_keys = np.repeat(prompt_idx, np.diff(ctx_offsets)) * stride + ctx_ids
+    diff_keys = np.repeat(prompt_idx, np.diff(diff_offsets)) * stride + diff_ids
+    return np.isin(ctx_keys, diff_keys)
+
+
+def calculate_cp_batch(prompts: List[Dict], diff_files_by_prompt: Dict[int, List[str]]) -> List[Dict]:
+    """Calculate Context Precision for many prompts at once
+    
+    File paths are interned to integer codes once for the whole batch and
+    laid out as CSR arrays (offsets + ids per prompt), so membership of every
+    context file in its prompt's diff set is resolved by one numeric kernel
+    (Numba for large batches when available, otherwise a single np.isin)
+    instead of per-prompt set hashing.
+    """
+    # Every path changed by any prompt; a context that misses all of them
+    # cannot intersect, so such prompts skip interning and the kernel
+    all_diff = frozenset(map(sys.intern, chain.from_iterable(diff_files_by_prompt.values())))
+    
+    path_codes = {}
+    context_lists = []
+    diff_lists = []
+    overlaps = []
+    ctx_offsets = [0]
+    ctx_codes = []
+    diff_offsets = [0]
+    diff_codes = []
     
     for prompt in prompts:
-        # Get diff files for this prompt
-        prompt_id = prompt.get('id')
-        diff_files_data = db.get_entries_for_prompt(
-            prompt_id, 
+        context_files = extract_context_files(prompt)
+        diff_files = diff_files_by_prompt.get(prompt.get('id'), [])
+        context_lists.append(context_files)
+        diff_lists.append(diff_files)
+        
+        overlap = bool(context_files) and not all_diff.isdisjoint(context_files)
+        overlaps.append(overlap)
+        if overlap:
+            for f in context_files:
+                ctx_codes.append(path_codes.setdefault(f, len(path_codes)))
+            for f in diff_files:
+                diff_codes.append(path_codes.setdefault(f, len(path_codes)))
+        ctx_offsets.append(len(ctx_codes))
+        diff_offsets.append(len(diff_codes))
+    
+    in_diff = _context_hits(
+        np.asarray(ctx_offsets, dtype=np.int64),
+        np.asarray(ctx_codes, dtype=np.int32),
+        np.asarray(diff_offsets, dtype=np.int64),
+        np.asarray(diff_codes, dtype=np.int32)
+    ).tolist()
+    
+    records = []
+    for i, (prompt, context_files, diff_files) in enumerate(zip(prompts, context_lists, diff_lists)):
+        if not context_files:
+            records.append(_empty_cp_record(prompt, diff_files))
+            continue
+        if not overlaps[i]:
+            records.append(_build_cp_record(prompt, context_files, diff_files, [], list(context_files)))
+            continue
+        
+        hits = in_diff[ctx_offsets[i]:ctx_offsets[i + 1]]
+        intersection = [f for f, hit in zip(context_files, hits) if hit]
+        unused = [f for f, hit in zip(context_files, hits) if not hit]
+        records.append(_build_cp_record(prompt, context_files, diff_files, intersection, unused))
+    
+    return records
+
+
+def calculate_baseline_cp(db: DatabaseConnector, workspace_path: str = None, limit: int = 1000) -> Dict:
+    """Calculate baseline CP for all prompts"""
+    with db.read_transaction():
+        # Only the columns CP needs; prompt bodies are never read here
+        prompts = db.get_prompts(workspace_path=workspace_path, limit=limit,
+                                 columns=('id', 'timestamp', 'context_files_json'))
+        
+        # Fetch diff files for all prompts up front instead of querying per prompt
+        diff_files_by_prompt = db.get_entries_for_prompts(
+            [p['id'] for p in prompts],
             time_window_seconds=config.CP_TIME_WINDOW_SECONDS
         )
-        diff_files = [e.get('file_path') for e in diff_files_data if e.get('file_path')]
-        
-        # Calculate CP
-        cp_record = calculate_cp(prompt, diff_files)
-        cp_scores.append(cp_record['cp'])
-        cp_records.append(cp_record)
     
-    if not cp_scores:
+    cp_records = calculate_cp_batch(prompts, diff_files_by_prompt)
+    
+    if not cp_records:
         return {
             'average': 0.0,
             'median': 0.0,
@@ -120,28 +226,18 @@ def calculate_baseline_cp(db: DatabaseConnector, workspace_path: str = None, lim
         }
     
     # Calculate statistics
-    cp_scores_sorted = sorted(cp_scores)
-    n = len(cp_scores_sorted)
-    
-    median = cp_scores_sorted[n // 2] if n > 0 else 0.0
-    if n % 2 == 0 and n > 1:
-        median = (cp_scores_sorted[n // 2 - 1] + cp_scores_sorted[n // 2]) / 2
-    
-    # Distribution buckets
-    distribution = {
-        '0.0-0.2': sum(1 for cp in cp_scores if 0.0 <= cp < 0.2),
-        '0.2-0.4': sum(1 for cp in cp_scores if 0.2 <= cp < 0.4),
-        '0.4-0.6': sum(1 for cp in cp_scores if 0.4 <= cp < 0.6),
-        '0.6-0.8': sum(1 for cp in cp_scores if 0.6 <= cp < 0.8),
-        '0.8-1.0': sum(1 for cp in cp_scores if 0.8 <= cp <= 1.0)
-    }
+    cp_scores = np.fromiter((r['cp'] for r in cp_records), dtype=np.float64, count=len(cp_records))
+    
+    # Distribution buckets (last bucket is closed, matching 0.8 <= cp <= 1.0)
+    counts, _ = np.histogram(cp_scores, bins=CP_BUCKET_EDGES)
+    distribution = dict(zip(CP_BUCKET_LABELS, counts.tolist()))
     
     return {
-        'average': sum(cp_scores) / len(cp_scores),
-        'median': median,
-        'min': min(cp_scores),
-        'max': max(cp_scores),
-        'count': len(cp_scores),
+        'average': float(cp_scores.mean()),
+        'median': float(np.median(cp_scores)),
+        'min': float(cp_scores.min()),
+        'max': float(cp_scores.max()),
+        'count': int(cp_scores.size),
         'distribution': distribution,
         'records': cp_records
     }
@@ -194,13 +290,13 @@ def main():
             sys.exit(1)
         
         # Output
-        output_json = json.dumps(result, indent=2)
+        output_json = json_dumps_indented(result)
         
         if args.output:
-            with open(args.output, 'w') as f:
+            with open(args.output, 'wb') as f:
                 f.write(output_json)
         else:
-            print(output_json)
+            sys.stdout.buffer.write(output_json + b'\n')
     
     finally:
         db.close()
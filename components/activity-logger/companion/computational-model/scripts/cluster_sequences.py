@@ -5,57 +5,81 @@ Clusters event sequences using DTW or other methods
 """
 
 import sys
-import json
 import argparse
 import numpy as np
+from collections import Counter
 from pathlib import Path
 
 # Add parent directory to path
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
+from json_utils import json_loads, json_dumps_indented
+
 try:
     from tslearn.clustering import TimeSeriesKMeans
-    from tslearn.preprocessing import TimeSeriesScalerMeanVariance
     HAS_TSLEARN = True
 except ImportError:
     HAS_TSLEARN = False
     print("[WARNING] tslearn not available, falling back to simple k-means")
 
 try:
-    from sklearn.cluster import KMeans
+    from dtw_band import dtw_kmeans
+    HAS_NUMBA = True
+except ImportError:
+    HAS_NUMBA = False
+
+# Sakoe-Chiba band radius as a fraction of the padded sequence length
+DTW_WINDOW_FRACTION = 0.1
+
+# k-means 'auto' switches to mini-batch updates above this many sequences
+MINIBATCH_MIN_SEQUENCES = 20_000
+
+try:
+    from sklearn.cluster import KMeans, MiniBatchKMeans
     from sklearn.preprocessing import StandardScaler
     HAS_SKLEARN = True
 except ImportError:
     HAS_SKLEARN = False
-    print("[ERROR] scikit-learn required but not installed")
-    sys.exit(1)
+    print("[ERROR] scikit-learn required but not installed", file=sys.stderr)
 
 
 def load_sequences(input_file=None):
     """Load sequences from stdin or file"""
     if input_file:
-        with open(input_file, 'r') as f:
-            return json.load(f)
+        with open(input_file, 'rb') as f:
+            return json_loads(f.read())
     else:
         # Read from stdin
-        return json.load(sys.stdin)
+        return json_loads(sys.stdin.buffer.read())
 
 
-def pad_sequences(sequences, max_length=None):
+def pad_sequences(sequences, max_length=None, dtype=np.float32):
     """Pad sequences to same length"""
     if max_length is None:
         max_length = max(len(s) for s in sequences)
+    vector_dim = len(sequences[0][0]) if len(sequences) and len(sequences[0]) else 0
     
-    padded = []
-    for seq in sequences:
-        if len(seq) < max_length:
-            # Pad with zeros
-            padding = [[0.0] * len(seq[0])] * (max_length - len(seq))
-            padded.append(seq + padding)
-        else:
-            padded.append(seq[:max_length])
+    # One zero-filled buffer; each sequence is copied into its leading rows
+    padded = np.zeros((len(sequences), max_length, vector_dim), dtype=dtype)
+    for i, seq in enumerate(sequences):
+        if len(seq):
+            arr = np.asarray(seq[:max_length], dtype=dtype)
+            padded[i, :arr.shape[0]] = arr
+    
+    return padded, max_length
+
+
+def scale_sequences(sequences_array):
+    """Z-normalize each series per dimension over time (as TimeSeriesScalerMeanVariance)
     
-    return np.array(padded), max_length
+    Works in place on the padded buffer, which is returned.
+    """
+    mean = sequences_array.mean(axis=1, keepdims=True)
+    std = sequences_array.std(axis=1, keepdims=True)
+    std[std == 0.0] = 1.0
+    np.subtract(sequences_array, mean, out=sequences_array)
+    np.divide(sequences_array, std, out=sequences_array)
+    return sequences_array
 
 
 def cluster_with_dtw(sequences, n_clusters, min_size=3):
@@ -66,16 +90,19 @@ def cluster_with_dtw(sequences, n_clusters, min_size=3):
     # Convert to numpy array and pad
     sequences_array, max_length = pad_sequences(sequences)
     
-    # Scale sequences
-    scaler = TimeSeriesScalerMeanVariance()
-    sequences_scaled = scaler.fit_transform(sequences_array)
+    # Scale sequences in place instead of allocating a scaled copy
+    sequences_scaled = scale_sequences(sequences_array)
     
-    # Cluster using DTW
+    # Cluster using DTW; n_jobs=-1 lets tslearn compute the pairwise DTW
+    # distances on a joblib thread pool (prefer="threads", with nogil numba
+    # kernels). tslearn depends on numba itself, so this runs only when
+    # dtw_band fails to import but tslearn does not.
     model = TimeSeriesKMeans(
         n_clusters=n_clusters,
         metric="dtw",
         max_iter=10,
-        random_state=42
+        random_state=42,
+        n_jobs=-1
     )
     
     labels = model.fit_predict(sequences_scaled)
@@ -83,105 +110,138 @@ def cluster_with_dtw(sequences, n_clusters, min_size=3):
     return labels, model
 
 
-def cluster_with_kmeans(sequences, n_clusters, min_size=3):
-    """Cluster sequences using standard k-means (flattened)"""
-    # Flatten sequences to fixed-size vectors
-    max_length = max(len(s) for s in sequences)
-    vector_dim = len(sequences[0][0]) if sequences else 0
-    
-    flattened = []
-    for seq in sequences:
-        # Flatten sequence
-        flat = []
-        for vec in seq:
-            flat.extend(vec)
-        # Pad to max_length
-        while len(flat) < max_length * vector_dim:
-            flat.append(0.0)
-        flattened.append(flat[:max_length * vector_dim])
-    
-    flattened = np.array(flattened)
-    
-    # Scale
-    scaler = StandardScaler()
+def cluster_with_dtw_fast(sequences, n_clusters, min_size=3):
+    """Cluster sequences with Numba banded DTW k-means (DBA centers)"""
+    if not HAS_NUMBA:
+        raise ImportError("numba required for fast DTW clustering")
+    
+    # Convert to numpy array and pad
+    sequences_array, max_length = pad_sequences(sequences)
+    sequences_scaled = scale_sequences(sequences_array)
+    
+    window = max(1, int(round(max_length * DTW_WINDOW_FRACTION)))
+    labels, centers = dtw_kmeans(sequences_scaled, n_clusters, window, max_iter=10, random_state=42)
+    
+    return labels, centers
+
+
+def cluster_with_kmeans(sequences, n_clusters, min_size=3, algo='auto'):
+    """Cluster sequences using standard k-means (flattened)
+    
+    algo is 'full', 'minibatch', or 'auto' (mini-batch only for large inputs).
+    """
+    # Flatten sequences to fixed-size vectors: pad into one (n, L, D) buffer,
+    # then view it as (n, L * D)
+    padded, max_length = pad_sequences(sequences)
+    flattened = padded.reshape(padded.shape[0], -1)
+    
+    # Scale (in place; the flattened buffer is not reused)
+    scaler = StandardScaler(copy=False)
     flattened_scaled = scaler.fit_transform(flattened)
     
+    if algo == 'auto':
+        algo = 'minibatch' if len(flattened_scaled) > MINIBATCH_MIN_SEQUENCES else 'full'
+    
     # Cluster
-    model = KMeans(n_clusters=n_clusters, random_state=42, n_init=10)
+    if algo == 'minibatch':
+        model = MiniBatchKMeans(n_clusters=n_clusters, random_state=42, n_init=3,
+                                batch_size=4096, reassignment_ratio=0.01)
+    else:
+        model = KMeans(n_clusters=n_clusters, random_state=42, n_init=10,
+                       algorithm='elkan', copy_x=False)
     labels = model.fit_predict(flattened_scaled)
     
     return labels, model
 
 
-def find_representative_sequence(cluster_sequences, all_sequences):
-    """Find most representative sequence in cluster (median length)"""
-    if not cluster_sequences:
-        return None
-    
-    avg_length = sum(len(all_sequences[idx]) for idx in cluster_sequences) / len(cluster_sequences)
-    
-    # Find sequence closest to average length
-    best_idx = cluster_sequences[0]
-    best_diff = abs(len(all_sequences[best_idx]) - avg_length)
+def top_event_types(type_codes, event_types, k=5):
+    """Most common event types among int type codes (-1 = unknown, skipped)
     
-    for idx in cluster_sequences[1:]:
-        diff = abs(len(all_sequences[idx]) - avg_length)
-        if diff < best_diff:
-            best_diff = diff
-            best_idx = idx
+    Ties keep first-appearance order, matching Counter.most_common.
+    """
+    type_codes = type_codes[type_codes >= 0]
+    if not type_codes.size:
+        return []
     
-    return best_idx
+    present, first_seen, counts = np.unique(type_codes, return_index=True, return_counts=True)
+    order = np.lexsort((first_seen, -counts))[:k]
+    return [event_types[code] for code in present[order]]
 
 
-def extract_common_event_types(cluster_sequences, all_sequences, event_types):
-    """Extract common event types in cluster"""
-    types_in_cluster = []
+def summarize_cluster(cluster_sequences, all_sequences, type_idx_arrays=None, event_types=None):
+    """Representative index, average length and top event types of a cluster
+    
+    Lengths and event types are gathered in one pass over the cluster; the
+    representative is the sequence closest to the average length. With
+    per-sequence type index arrays, the pass collects int codes instead of
+    counting event dicts.
+    """
+    use_codes = type_idx_arrays is not None and bool(event_types)
+    lengths = {}
+    code_chunks = []
+    type_counts = Counter()
     for idx in cluster_sequences:
         seq = all_sequences[idx]
-        for event in seq:
-            if event.get('event_type'):
-                types_in_cluster.append(event['event_type'])
-    
-    # Count frequencies
-    from collections import Counter
-    type_counts = Counter(types_in_cluster)
-    return [t for t, _ in type_counts.most_common(5)]
+        lengths[idx] = len(seq)
+        if use_codes:
+            code_chunks.append(type_idx_arrays[idx])
+        else:
+            type_counts.update(event['event_type'] for event in seq if event.get('event_type'))
+    
+    avg_length = sum(lengths.values()) / len(cluster_sequences)
+    representative_idx = min(cluster_sequences, key=lambda idx: abs(lengths[idx] - avg_length))
+    
+    if use_codes:
+        return representative_idx, avg_length, top_event_types(np.concatenate(code_chunks), event_types)
+    return representative_idx, avg_length, [t for t, _ in type_counts.most_common(5)]
 
 
-def main():
-    parser = argparse.ArgumentParser(description='Cluster event sequences')
-    parser.add_argument('--method', choices=['dtw', 'kmeans'], default='dtw',
-                       help='Clustering method')
-    parser.add_argument('--n-clusters', type=int, default=10,
-                       help='Number of clusters')
-    parser.add_argument('--min-size', type=int, default=3,
-                       help='Minimum cluster size')
-    parser.add_argument('--input', type=str, default=None,
-                       help='Input JSON file (default: stdin)')
-    parser.add_argument('--output', type=str, default=None,
-                       help='Output JSON file (default: stdout)')
-    
-    args = parser.parse_args()
+def run(data, method='dtw', n_clusters=10, min_size=3, kmeans_algo='auto'):
+    """Cluster sequences and build the behavioral library
     
-    # Load sequences
-    data = load_sequences(args.input)
+    `data` is either {'sequences': [...], 'event_types': [...], 'metadata': {...}}
+    or a bare list of sequences. Raises on clustering failure.
+    """
+    if not HAS_SKLEARN:
+        raise ImportError("scikit-learn required for clustering")
     
     if 'sequences' in data:
         sequences = data['sequences']
         event_types = data.get('event_types', [])
         metadata = data.get('metadata', {})
+        # Optional per-sequence arrays from the in-process pipeline
+        type_idx_arrays = data.get('event_type_idx')
+        vector_blocks = data.get('vectors')
     else:
         # Assume data is list of sequences
         sequences = data
         event_types = []
         metadata = {}
+        type_idx_arrays = None
+        vector_blocks = None
+    
+    # One-hot rows per event type index; index -1 (unknown type) selects the
+    # trailing all-zero row
+    type_table = None
+    if event_types:
+        type_table = np.vstack([
+            np.eye(len(event_types), dtype=np.float32),
+            np.zeros((1, len(event_types)), dtype=np.float32)
+        ])
     
     # Extract vectors
     sequence_vectors = []
     all_sequences = []
     
-    for seq in sequences:
-        if isinstance(seq, dict) and 'combined_vector' in seq:
+    for i, seq in enumerate(sequences):
+        if vector_blocks is not None:
+            # Contiguous (L, D) block already built by the vectorizer
+            all_sequences.append(seq)
+            vectors = vector_blocks[i]
+            if type_table is not None and type_idx_arrays is not None:
+                vectors = np.hstack([type_table[type_idx_arrays[i]], vectors])
+            sequence_vectors.append(vectors)
+        elif isinstance(seq, dict) and 'combined_vector' in seq:
             # Single sequence
             all_sequences.append([seq])
             sequence_vectors.append([seq['combined_vector']])
@@ -189,21 +249,24 @@ def main():
             # Sequence of events
             all_sequences.append(seq)
             vectors = [e.get('combined_vector', []) for e in seq]
+            if type_table is not None and seq and 'event_type_idx' in seq[0]:
+                # Prepend the expanded event-type block to the embedding block
+                type_idx = np.fromiter((e.get('event_type_idx', -1) for e in seq),
+                                       dtype=np.intp, count=len(seq))
+                vectors = np.hstack([type_table[type_idx], np.asarray(vectors, dtype=np.float32)])
             sequence_vectors.append(vectors)
         else:
             # Raw vectors
             all_sequences.append([{'combined_vector': seq}])
             sequence_vectors.append([seq] if isinstance(seq[0], (int, float)) else seq)
     
-    # Cluster
-    try:
-        if args.method == 'dtw' and HAS_TSLEARN:
-            labels, model = cluster_with_dtw(sequence_vectors, args.n_clusters, args.min_size)
-        else:
-            labels, model = cluster_with_kmeans(sequence_vectors, args.n_clusters, args.min_size)
-    except Exception as e:
-        print(f"[ERROR] Clustering failed: {e}", file=sys.stderr)
-        sys.exit(1)
+    # Cluster (tslearn DTW only when dtw_band cannot be imported)
+    if method == 'dtw' and HAS_NUMBA:
+        labels, model = cluster_with_dtw_fast(sequence_vectors, n_clusters, min_size)
+    elif method == 'dtw' and HAS_TSLEARN:
+        labels, model = cluster_with_dtw(sequence_vectors, n_clusters, min_size)
+    else:
+        labels, model = cluster_with_kmeans(sequence_vectors, n_clusters, min_size, kmeans_algo)
     
     # Organize clusters
     clusters = {}
@@ -215,42 +278,71 @@ def main():
     # Build behavioral library
     behavioral_library = []
     for cluster_id, sequence_indices in clusters.items():
-        if len(sequence_indices) >= args.min_size:
-            representative_idx = find_representative_sequence(sequence_indices, all_sequences)
-            representative = all_sequences[representative_idx] if representative_idx is not None else None
+        if len(sequence_indices) >= min_size:
+            representative_idx, avg_length, common_types = summarize_cluster(
+                sequence_indices, all_sequences, type_idx_arrays, event_types)
             
             behavioral_library.append({
                 'cluster_id': int(cluster_id),
                 'frequency': len(sequence_indices),
-                'representative_sequence': representative,
+                'representative_sequence': all_sequences[representative_idx],
                 'sequence_indices': sequence_indices,
                 'metadata': {
-                    'avg_length': sum(len(all_sequences[idx]) for idx in sequence_indices) / len(sequence_indices),
-                    'event_types': extract_common_event_types(sequence_indices, all_sequences, event_types)
+                    'avg_length': avg_length,
+                    'event_types': common_types
                 }
             })
     
-    # Output results
-    result = {
-        'method': args.method,
-        'n_clusters': args.n_clusters,
-        'min_size': args.min_size,
+    return {
+        'method': method,
+        'n_clusters': n_clusters,
+        'min_size': min_size,
         'total_sequences': len(sequences),
         'clusters_found': len(behavioral_library),
         'cluster_assignments': labels.tolist(),
         'behavioral_library': behavioral_library,
         'metadata': metadata
     }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Cluster event sequences')
+    parser.add_argument('--method', choices=['dtw', 'kmeans'], default='dtw',
+                       help='Clustering method')
+    parser.add_argument('--n-clusters', type=int, default=10,
+                       help='Number of clusters')
+    parser.add_argument('--min-size', type=int, default=3,
+                       help='Minimum cluster size')
+    parser.add_argument('--kmeans-algo', choices=['auto', 'full', 'minibatch'], default='auto',
+                       help='k-means variant (auto: mini-batch above %d sequences)' % MINIBATCH_MIN_SEQUENCES)
+    parser.add_argument('--input', type=str, default=None,
+                       help='Input JSON file (default: stdin)')
+    parser.add_argument('--output', type=str, default=None,
+                       help='Output JSON file (default: stdout)')
+    
+    args = parser.parse_args()
+    
+    if not HAS_SKLEARN:
+        sys.exit(1)
+    
+    # Load sequences
+    data = load_sequences(args.input)
+    
+    # Cluster and build library
+    try:
+        result = run(data, args.method, args.n_clusters, args.min_size, args.kmeans_algo)
+    except Exception as e:
+        print(f"[ERROR] Clustering failed: {e}", file=sys.stderr)
+        sys.exit(1)
     
-    output_json = json.dumps(result, indent=2)
+    output_json = json_dumps_indented(result)
     
     if args.output:
-        with open(args.output, 'w') as f:
+        with open(args.output, 'wb') as f:
             f.write(output_json)
     else:
-        print(output_json)
+        sys.stdout.buffer.write(output_json + b'\n')
 
 
 if __name__ == '__main__':
     main()
-
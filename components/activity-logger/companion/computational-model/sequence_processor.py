@@ -3,23 +3,33 @@ Main Sequence Processor Service
 Orchestrates the computational model pipeline
 """
 
-import json
 import sys
 import numpy as np
+from operator import itemgetter
 from pathlib import Path
 from typing import List, Dict, Optional
 from tqdm import tqdm
 
 from database_connector import DatabaseConnector
 from vectorizer import EventVectorizer
+from json_utils import json_dumps_indented
 import config
 
 
+def _json_default(obj):
+    """Serialize NumPy vectors and scalars (e.g. combined_vector) for JSON output"""
+    if isinstance(obj, (np.ndarray, np.generic)):
+        return obj.tolist()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
 class SequenceProcessor:
     """Main service for processing sequences and building behavioral library"""
     
-    def __init__(self):
-        self.db = DatabaseConnector()
+    def __init__(self, db: Optional[DatabaseConnector] = None):
+        # A connector passed in is shared with the caller, who closes it
+        self._owns_db = db is None
+        self.db = db if db is not None else DatabaseConnector()
         self.vectorizer = EventVectorizer()
     
     def extract_sequences(self, workspace_path: Optional[str] = None, 
@@ -30,21 +40,18 @@ class SequenceProcessor:
         # Get events with prompts
         events = self.db.get_events_with_prompts(workspace_path=workspace_path)
         
-        # Group by session
+        # Group by session (first-appearance order)
         sequences_by_session = {}
         for event in events:
-            session = event.get('session_id') or 'default'
-            if session not in sequences_by_session:
-                sequences_by_session[session] = []
-            sequences_by_session[session].append(event)
+            sequences_by_session.setdefault(event.get('session_id') or 'default', []).append(event)
         
-        # Sort each session by timestamp
+        # Filter by length, then sort only the kept sessions by timestamp.
+        # Rows arrive ordered by timestamp, so each sort is a linear pass.
+        by_timestamp = itemgetter('timestamp')
         sequences = []
         for session_events in sequences_by_session.values():
-            session_events.sort(key=lambda e: e.get('timestamp', ''))
-            
-            # Filter by length
             if min_sequence_length <= len(session_events) <= max_sequence_length:
+                session_events.sort(key=by_timestamp)
                 sequences.append(session_events)
         
         print(f"[SEQUENCE-PROCESSOR] Extracted {len(sequences)} sequences")
@@ -64,12 +71,19 @@ class SequenceProcessor:
                 if prompt_id and 'prompt_text' in event:
                     prompts_map[prompt_id] = {'text': event.get('prompt_text')}
         
+        # Embed every distinct prompt text in one batch
+        unique_texts = list({p['text'] for p in prompts_map.values() if p.get('text')})
+        embeddings = self.vectorizer.embed_texts(unique_texts)
+        
         # Vectorize sequences
         vectorized_sequences = []
         for seq in tqdm(sequences, desc="Vectorizing sequences"):
-            vectorized = self.vectorizer.vectorize_sequence(seq, prompts_map)
+            vectorized, type_idx, vectors = self.vectorizer.vectorize_sequence_arrays(
+                seq, prompts_map, embeddings)
             vectorized_sequences.append({
                 'sequence': vectorized,
+                'event_type_idx': type_idx,
+                'vectors': vectors,
                 'metadata': {
                     'session_id': seq[0].get('session_id') if seq else None,
                     'workspace_path': seq[0].get('workspace_path') if seq else None,
@@ -87,52 +101,33 @@ class SequenceProcessor:
                          method: str = None,
                          n_clusters: int = None,
                          min_cluster_size: int = None) -> Dict:
-        """Cluster sequences using external script"""
-        import subprocess
-        import tempfile
+        """Cluster sequences in-process (no subprocess/JSON round-trip)"""
+        from scripts.cluster_sequences import run as run_clustering
         
         method = method or config.CLUSTERING_METHOD
         n_clusters = n_clusters or config.MAX_CLUSTERS
         min_cluster_size = min_cluster_size or config.MIN_CLUSTER_SIZE
         
         # Prepare input data
+        type_map = self.vectorizer.event_type_map
         sequences_data = {
             'sequences': [vs['sequence'] for vs in vectorized_sequences],
+            # Per-sequence (L,) type indices and (L, D) blocks, used as-is
+            'event_type_idx': [vs['event_type_idx'] for vs in vectorized_sequences],
+            'vectors': [vs['vectors'] for vs in vectorized_sequences],
+            # Index order of event_type_idx, for one-hot expansion
+            'event_types': sorted(type_map, key=type_map.get),
             'metadata': {
                 'total_sequences': len(vectorized_sequences),
                 'method': method
             }
         }
         
-        # Write to temp file
-        with tempfile.NamedTemporaryFile(mode='w', suffix='.json', delete=False) as f:
-            json.dump(sequences_data, f)
-            input_file = f.name
-        
         try:
-            # Call clustering script
-            script_path = Path(__file__).parent / 'scripts' / 'cluster_sequences.py'
-            result = subprocess.run(
-                [
-                    'python3',
-                    str(script_path),
-                    '--method', method,
-                    '--n-clusters', str(n_clusters),
-                    '--min-size', str(min_cluster_size),
-                    '--input', input_file
-                ],
-                capture_output=True,
-                text=True,
-                check=True
-            )
-            
-            return json.loads(result.stdout)
-        except subprocess.CalledProcessError as e:
-            print(f"[ERROR] Clustering failed: {e.stderr}", file=sys.stderr)
+            return run_clustering(sequences_data, method, n_clusters, min_cluster_size)
+        except Exception as e:
+            print(f"[ERROR] Clustering failed: {e}", file=sys.stderr)
             raise
-        finally:
-            # Clean up temp file
-            Path(input_file).unlink()
     
     def build_behavioral_library(self, workspace_path: Optional[str] = None,
                                 min_cp: float = None) -> Dict:
@@ -186,14 +181,17 @@ class SequenceProcessor:
         
         output_path.parent.mkdir(parents=True, exist_ok=True)
         
-        with open(output_path, 'w') as f:
-            json.dump(library, f, indent=2)
+        # NumPy vectors are serialized natively when orjson is available
+        with open(output_path, 'wb') as f:
+            f.write(json_dumps_indented(library, default=_json_default))
         
         print(f"[SEQUENCE-PROCESSOR] Saved library to {output_path}")
     
     def close(self):
-        """Close database connections"""
-        self.db.close()
+        """Close database and HTTP connections"""
+        if self._owns_db:
+            self.db.close()
+        self.vectorizer.close()
 
 
 def main():
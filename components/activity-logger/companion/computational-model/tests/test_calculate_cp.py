@@ -0,0 +1,36 @@
+import numpy as np
+import pytest
+
+from scripts import calculate_cp
+
+
+def _csr(rng, n_prompts, max_len, n_paths):
+    lengths = rng.integers(0, max_len, n_prompts)
+    offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+    return offsets, rng.integers(0, n_paths, offsets[-1]).astype(np.int32)
+
+
+@pytest.mark.skipif(not calculate_cp.HAS_NUMBA, reason="numba not installed")
+def test_kernel_matches_isin(monkeypatch):
+    rng = np.random.default_rng(0)
+    ctx_offsets, ctx_ids = _csr(rng, 200, 12, 50)
+    diff_offsets, diff_ids = _csr(rng, 200, 12, 50)
+    
+    small = calculate_cp._context_hits(ctx_offsets, ctx_ids, diff_offsets, diff_ids)
+    monkeypatch.setattr(calculate_cp, 'NUMBA_MIN_CONTEXT_FILES', 0)
+    large = calculate_cp._context_hits(ctx_offsets, ctx_ids, diff_offsets, diff_ids)
+    
+    assert np.array_equal(small, large)
+
+
+def test_calculate_cp_batch_small_batch():
+    prompts = [
+        {'id': 1, 'timestamp': 't1', 'context_files_json': '["a.py", "b.py"]'},
+        {'id': 2, 'timestamp': 't2', 'context_files_json': '["c.py"]'},
+        {'id': 3, 'timestamp': 't3', 'context_files_json': None},
+    ]
+    records = calculate_cp.calculate_cp_batch(prompts, {1: ['b.py'], 2: ['a.py']})
+    
+    assert [r['cp'] for r in records] == [0.5, 0.0, 0.0]
+    assert records[0]['intersection'] == ['b.py']
+    assert records[1]['unused_context_files'] == ['c.py']
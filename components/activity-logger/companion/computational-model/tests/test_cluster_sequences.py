@@ -0,0 +1,18 @@
+import numpy as np
+
+from scripts.cluster_sequences import summarize_cluster
+
+
+def test_summarize_cluster_codes_match_event_dicts():
+    event_types = ['Agent', 'Edit', 'Run']
+    codes = [[0, 1, 1], [2, 1], [0, 0, 2, 1], [1]]
+    all_sequences = [[{'event_type': event_types[c]} for c in seq] for seq in codes]
+    type_idx_arrays = [np.array(seq, dtype=np.int32) for seq in codes]
+    
+    for indices in ([0, 1, 2], [1, 3], [2]):
+        from_dicts = summarize_cluster(indices, all_sequences)
+        from_codes = summarize_cluster(indices, all_sequences, type_idx_arrays, event_types)
+        assert from_codes == from_dicts
+    
+    assert summarize_cluster([0, 1, 2], all_sequences, type_idx_arrays, event_types) == (
+        0, 3.0, ['Edit', 'Agent', 'Run'])
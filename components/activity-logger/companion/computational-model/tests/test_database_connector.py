@@ -0,0 +1,100 @@
+import sqlite3
+
+import pytest
+
+import config
+from database_connector import DatabaseConnector
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    path = tmp_path / 'companion.db'
+    conn = sqlite3.connect(path)
+    conn.executescript("""
+        CREATE TABLE events (id INTEGER PRIMARY KEY, session_id TEXT, workspace_path TEXT,
+                             timestamp TEXT, type TEXT, prompt_id INTEGER);
+        CREATE TABLE prompts (id INTEGER PRIMARY KEY, timestamp TEXT, text TEXT,
+                              workspace_path TEXT, context_files_json TEXT);
+        CREATE TABLE entries (id INTEGER PRIMARY KEY, workspace_path TEXT, file_path TEXT,
+                              timestamp TEXT, prompt_id INTEGER);
+        INSERT INTO prompts (id, timestamp, text) VALUES (1, '2024-01-01T00:00:00', 'fix it');
+    """)
+    conn.close()
+    monkeypatch.setattr(config, 'DATABASE_TYPE', 'sqlite')
+    monkeypatch.setattr(config, 'DATABASE_PATH', str(path))
+    connector = DatabaseConnector()
+    yield connector
+    connector.close()
+
+
+def test_nested_read_transaction_joins_outer(db):
+    conn = db.sqlite_conn
+    with db.read_transaction():
+        with db.read_transaction():
+            assert conn.in_transaction
+            assert len(db.get_prompts()) == 1
+        # Inner exit must not commit the outer transaction
+        assert conn.in_transaction
+    assert not conn.in_transaction
+
+
+def test_read_transaction_commits_after_error(db):
+    with pytest.raises(RuntimeError):
+        with db.read_transaction():
+            with db.read_transaction():
+                raise RuntimeError('boom')
+    assert not db.sqlite_conn.in_transaction
+    
+    # The depth is reset, so a new transaction starts cleanly
+    with db.read_transaction():
+        assert db.sqlite_conn.in_transaction
+
+
+def test_worker_thread_connection_released_on_exit(db):
+    import gc
+    import threading
+    
+    opened = []
+    
+    def worker():
+        opened.append(db.sqlite_conn)
+        db.get_prompts()
+    
+    main_conn = db.sqlite_conn
+    thread = threading.Thread(target=worker)
+    thread.start()
+    thread.join()
+    gc.collect()
+    
+    assert db._connections == [main_conn]
+    with pytest.raises(sqlite3.ProgrammingError):
+        opened[0].execute('SELECT 1')
+    # The main thread's connection stays open until close()
+    main_conn.execute('SELECT 1')
+
+
+def test_index_creation_is_opt_in_and_quiet_on_stdout(db, capsys):
+    import time
+    
+    listing = "SELECT name FROM sqlite_master WHERE type = 'index' AND name LIKE 'idx_%'"
+    assert db.execute_query(listing) == []
+    
+    # The companion holds the write lock while we try to create indexes
+    writer = sqlite3.connect(db.db_path, isolation_level=None)
+    writer.execute('BEGIN IMMEDIATE')
+    try:
+        start = time.monotonic()
+        locked = DatabaseConnector(create_indexes=True)
+        elapsed = time.monotonic() - start
+        locked.close()
+    finally:
+        writer.execute('ROLLBACK')
+        writer.close()
+    
+    captured = capsys.readouterr()
+    assert elapsed < 2
+    assert captured.out == ''
+    assert 'Could not ensure database indexes' in captured.err
+    
+    DatabaseConnector(create_indexes=True).close()
+    assert len(db.execute_query(listing)) == 5
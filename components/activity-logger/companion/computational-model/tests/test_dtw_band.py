@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('numba')
+from dtw_band import dtw_cross, dtw_distance
+
+tslearn_metrics = pytest.importorskip('tslearn.metrics')
+
+
+def _tslearn_dtw(x, y, radius):
+    return tslearn_metrics.dtw(x, y, global_constraint='sakoe_chiba', sakoe_chiba_radius=radius)
+
+
+@pytest.mark.parametrize('n, m, radius', [
+    (20, 20, 2), (20, 20, 0), (8, 8, 100),
+    (20, 12, 1), (15, 20, 0), (15, 20, 3), (1, 5, 0),
+])
+def test_distance_matches_tslearn(n, m, radius):
+    rng = np.random.default_rng(n * 100 + m + radius)
+    x = rng.normal(size=(n, 3))
+    y = rng.normal(size=(m, 3))
+    
+    assert dtw_distance(x, y, radius) == pytest.approx(_tslearn_dtw(x, y, radius))
+    assert dtw_distance(y, x, radius) == pytest.approx(_tslearn_dtw(y, x, radius))
+
+
+def test_zero_radius_equal_length_is_euclidean():
+    rng = np.random.default_rng(0)
+    x = rng.normal(size=(10, 2))
+    y = rng.normal(size=(10, 2))
+    
+    assert dtw_distance(x, y, 0) == pytest.approx(np.linalg.norm(x - y))
+
+
+def test_cross_matches_pairwise():
+    rng = np.random.default_rng(1)
+    X = rng.normal(size=(5, 12, 2))
+    Y = rng.normal(size=(3, 12, 2))
+    
+    expected = [[dtw_distance(x, y, 2) for y in Y] for x in X]
+    np.testing.assert_allclose(dtw_cross(X, Y, 2), expected)
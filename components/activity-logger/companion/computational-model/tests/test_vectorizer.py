@@ -0,0 +1,106 @@
+import numpy as np
+import pytest
+
+import config
+import vectorizer as vectorizer_module
+from vectorizer import EmbeddingCache, EventVectorizer
+
+
+@pytest.fixture(autouse=True)
+def offline_embeddings(monkeypatch):
+    # Whatever the environment sets, never load a real model or call an API
+    monkeypatch.setattr(config, 'EMBEDDING_SERVICE', 'local')
+    monkeypatch.setattr(config, 'OPENROUTER_API_KEY', '')
+    monkeypatch.setattr(config, 'HF_TOKEN', '')
+    monkeypatch.setattr(vectorizer_module, 'HAS_LOCAL_EMBEDDINGS', False)
+
+
+@pytest.fixture
+def cache_path(tmp_path, monkeypatch):
+    path = tmp_path / 'embedding_cache.db'
+    monkeypatch.setattr(config, 'EMBEDDING_CACHE_PATH', path)
+    return path
+
+
+def _warm_cache(path, texts, dim):
+    cache = EmbeddingCache(path, f'{config.EMBEDDING_SERVICE}:{config.EMBEDDING_MODEL}')
+    cache.put_many({text: np.full(dim, i + 1, dtype=np.float32) for i, text in enumerate(texts)})
+    cache.close()
+
+
+def test_warm_cache_sets_embedding_width(cache_path):
+    _warm_cache(cache_path, ['fix the bug', 'add a test'], 1536)
+    
+    vectorizer = EventVectorizer()
+    try:
+        events = [
+            {'id': 1, 'type': 'Agent', 'prompt_id': 10},
+            {'id': 2, 'type': 'Edit', 'prompt_id': None},
+            {'id': 3, 'type': 'Agent', 'prompt_id': 11},
+        ]
+        vectorizer.build_event_type_encoder(events)
+        prompts_map = {10: {'text': 'fix the bug'}, 11: {'text': 'add a test'}}
+        embeddings = vectorizer.embed_texts(['fix the bug', 'add a test'])
+        
+        assert vectorizer.embedding_dim == 1536
+        sequence, type_idx, vectors = vectorizer.vectorize_sequence_arrays(events, prompts_map, embeddings)
+    finally:
+        vectorizer.close()
+    
+    assert vectors.shape == (3, 1536)
+    assert type_idx.tolist() == [0, 1, 0]
+    assert not vectors[1].any()
+    assert sequence[2]['combined_vector'][0] == 2.0
+
+
+def test_warm_cache_single_text(cache_path):
+    _warm_cache(cache_path, ['fix the bug'], 1536)
+    
+    vectorizer = EventVectorizer()
+    try:
+        assert vectorizer.embed_text('fix the bug').shape == (1536,)
+        assert vectorizer.embedding_dim == 1536
+    finally:
+        vectorizer.close()
+
+
+def test_sequence_width_follows_passed_embeddings(cache_path):
+    vectorizer = EventVectorizer()
+    try:
+        # Stored width is stale relative to the embeddings handed in
+        vectorizer.embedding_dim = 768
+        events = [{'id': 1, 'type': 'Agent', 'prompt_id': 10}, {'id': 2, 'type': 'Agent'}]
+        vectorizer.build_event_type_encoder(events)
+        embeddings = {'fix the bug': np.ones(1536, dtype=np.float32)}
+        
+        _, _, vectors = vectorizer.vectorize_sequence_arrays(
+            events, {10: {'text': 'fix the bug'}}, embeddings)
+        event = vectorizer.vectorize_event(events[1])
+    finally:
+        vectorizer.close()
+    
+    assert vectors.shape == (2, 1536)
+    assert event['combined_vector'].shape == (1536,)
+
+
+class _FakeModel:
+    def encode(self, texts, batch_size=None, convert_to_numpy=True):
+        return np.ones((len(texts), 384), dtype=np.float32)
+
+
+def test_cache_errors_fall_through_to_encoding(cache_path, capsys):
+    vectorizer = EventVectorizer()
+    try:
+        vectorizer.embedding_model = _FakeModel()
+        # Break the cache after it opened, as a corrupted file would
+        vectorizer.embedding_cache.conn.execute("DROP TABLE embeddings")
+        
+        embeddings = vectorizer.embed_texts(['fix the bug', 'add a test'])
+    finally:
+        vectorizer.close()
+    
+    assert sorted(embeddings) == ['add a test', 'fix the bug']
+    assert vectorizer.embedding_dim == 384
+    err = capsys.readouterr().err
+    assert 'Failed to read embedding cache' in err
+    assert 'Failed to write embedding cache' in err
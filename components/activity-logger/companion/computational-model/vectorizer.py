@@ -3,12 +3,19 @@ Event Vectorization Service
 Transforms raw events into numerical vectors for sequence analysis
 """
 
-import json
+import hashlib
+import sqlite3
+import sys
 import numpy as np
-from typing import List, Dict, Optional
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from pathlib import Path
+from typing import List, Dict, Iterable, Optional, Tuple
+from json_utils import json_dumps, json_loads
 import config
 
 try:
+    import torch
     from sentence_transformers import SentenceTransformer
     HAS_LOCAL_EMBEDDINGS = True
 except ImportError:
@@ -16,11 +23,116 @@ except ImportError:
 
 try:
     import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
     HAS_REQUESTS = True
 except ImportError:
     HAS_REQUESTS = False
     print("[WARNING] requests not available, API-based embeddings will fail")
 
+# Texts per API embedding request, and concurrent requests in flight
+REMOTE_EMBED_BATCH_SIZE = 64
+REMOTE_EMBED_WORKERS = 16
+
+# Embedding endpoints are fixed for the process lifetime
+OPENROUTER_EMBEDDINGS_URL = 'https://openrouter.ai/api/v1/embeddings'
+HF_EMBEDDINGS_URL = config.HF_ENDPOINT or f'https://api-inference.huggingface.co/pipeline/feature-extraction/{config.EMBEDDING_MODEL}'
+
+
+class EmbeddingCache:
+    """Persistent text -> embedding cache backed by a SQLite file
+    
+    Keys are BLAKE2b digests of (service, model, text): stable across runs,
+    unlike process-randomized hash(), and separate per embedding model.
+    """
+    
+    def __init__(self, path: Path, namespace: str):
+        self.namespace = namespace
+        self.conn = None
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            self.conn = sqlite3.connect(str(path))
+            self.conn.executescript("""
+                PRAGMA journal_mode=WAL;
+                PRAGMA synchronous=NORMAL;
+                CREATE TABLE IF NOT EXISTS embeddings (
+                    key BLOB PRIMARY KEY,
+                    vector BLOB NOT NULL
+                ) WITHOUT ROWID;
+            """)
+        except sqlite3.Error as e:
+            print(f"[WARNING] Embedding cache unavailable: {e}", file=sys.stderr)
+            self.conn = None
+    
+    def _key(self, text: str) -> bytes:
+        return hashlib.blake2b(f'{self.namespace}\0{text}'.encode('utf-8'), digest_size=16).digest()
+    
+    def get_many(self, texts: Iterable[str]) -> Dict[str, np.ndarray]:
+        """Cached embeddings for the texts that have one
+        
+        A failed lookup (locked or corrupt file) is treated as a miss, so
+        callers recompute those texts instead of aborting.
+        """
+        if not self.conn:
+            return {}
+        
+        texts_by_key = {self._key(text): text for text in texts}
+        keys = list(texts_by_key)
+        found = {}
+        try:
+            # SQLite caps bound parameters per statement, so batch the IN list
+            for i in range(0, len(keys), 500):
+                batch = keys[i:i + 500]
+                placeholders = ','.join('?' * len(batch))
+                rows = self.conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+                )
+                for key, vector in rows:
+                    found[texts_by_key[key]] = np.frombuffer(vector, dtype=np.float32)
+        except sqlite3.Error as e:
+            print(f"[WARNING] Failed to read embedding cache: {e}", file=sys.stderr)
+        return found
+    
+    def get(self, text: str) -> Optional[np.ndarray]:
+        """Cached embedding for a text, if any"""
+        return self.get_many([text]).get(text)
+    
+    def put_many(self, embeddings: Dict[str, np.ndarray]):
+        """Store embeddings in one transaction"""
+        if not self.conn or not embeddings:
+            return
+        try:
+            with self.conn:
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                    ((self._key(text), np.asarray(embedding, dtype=np.float32).tobytes())
+                     for text, embedding in embeddings.items())
+                )
+        except sqlite3.Error as e:
+            print(f"[WARNING] Failed to write embedding cache: {e}", file=sys.stderr)
+    
+    def put(self, text: str, embedding: np.ndarray):
+        """Store one embedding"""
+        self.put_many({text: embedding})
+    
+    def close(self):
+        """Close the cache database"""
+        if self.conn:
+            self.conn.close()
+            self.conn = None
+
+
+@lru_cache(maxsize=1)
+def _load_embedding_model(model_name: str, device: str):
+    """Load the local SentenceTransformer once per process; later vectorizers reuse it"""
+    model = SentenceTransformer(model_name, device=device)
+    if device == 'cuda':
+        # fp16 runs the encoder on tensor cores; outputs are cast
+        # back to float32 before caching
+        model.half()
+    print(f"[VECTORIZER] Loaded local embedding model: {model_name} ({device})")
+    return model
+
 
 class EventVectorizer:
     """Vectorizes events for sequence analysis"""
@@ -28,19 +140,58 @@ class EventVectorizer:
     def __init__(self):
         self.event_type_map = {}
         self.embedding_model = None
-        self.embedding_cache = {}
+        self.embedding_cache = EmbeddingCache(
+            config.EMBEDDING_CACHE_PATH,
+            f'{config.EMBEDDING_SERVICE}:{config.EMBEDDING_MODEL}'
+        )
+        # Width of the prompt embedding block; 768 for all-mpnet-base-v2,
+        # updated from the first embedding actually produced
+        self.embedding_dim = 768
+        self._zeros = None
+        self.http_session = self._create_http_session() if HAS_REQUESTS else None
+        self._openrouter_headers = {
+            'Authorization': f'Bearer {config.OPENROUTER_API_KEY}',
+            'Content-Type': 'application/json'
+        }
+        self._hf_headers = {
+            'Authorization': f'Bearer {config.HF_TOKEN}',
+            'Content-Type': 'application/json'
+        }
         
         # Initialize embedding model
+        self.encode_batch_size = 64
         if config.EMBEDDING_SERVICE == 'local' and HAS_LOCAL_EMBEDDINGS:
             try:
-                self.embedding_model = SentenceTransformer(config.EMBEDDING_MODEL)
-                print(f"[VECTORIZER] Loaded local embedding model: {config.EMBEDDING_MODEL}")
+                device = 'cuda' if torch.cuda.is_available() else 'cpu'
+                self.embedding_model = _load_embedding_model(config.EMBEDDING_MODEL, device)
+                if device == 'cuda':
+                    self.encode_batch_size = 256
             except Exception as e:
                 print(f"[VECTORIZER] Failed to load local model: {e}")
                 self.embedding_model = None
+        elif config.EMBEDDING_SERVICE == 'local':
+            print("[WARNING] sentence-transformers not available; "
+                  "install it for local embeddings: pip install sentence-transformers")
+    
+    def _create_http_session(self):
+        """Create a keep-alive session so API embeddings reuse TCP/TLS connections"""
+        session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=8,
+            pool_maxsize=32,
+            max_retries=Retry(
+                total=3,
+                backoff_factor=0.1,
+                status_forcelist=[429, 502, 503, 504],
+                allowed_methods=None  # embedding POSTs are idempotent
+            )
+        )
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
     
     def build_event_type_encoder(self, events: List[Dict]):
-        """Build one-hot encoding map for event types"""
+        """Build the event type -> index map (expanded to one-hot at clustering)"""
         event_types = set()
         for event in events:
             if event.get('type'):
@@ -49,15 +200,13 @@ class EventVectorizer:
         self.event_type_map = {et: idx for idx, et in enumerate(sorted(event_types))}
         print(f"[VECTORIZER] Built event type encoder with {len(self.event_type_map)} types")
     
-    def one_hot_encode_event_type(self, event_type: str) -> np.ndarray:
-        """One-hot encode event type"""
-        if not self.event_type_map:
-            return np.array([])
+    def _track_embedding_width(self, embedding: np.ndarray):
+        """Follow the width of an embedding actually in use
         
-        vector = np.zeros(len(self.event_type_map))
-        if event_type in self.event_type_map:
-            vector[self.event_type_map[event_type]] = 1.0
-        return vector
+        A warm cache or a non-default model may hold a width other than the
+        768 default; zero blocks and sequence arrays are sized from this.
+        """
+        self.embedding_dim = len(embedding)
     
     def embed_text(self, text: str) -> Optional[np.ndarray]:
         """Embed text using configured service (synchronous)"""
@@ -65,16 +214,17 @@ class EventVectorizer:
             return None
         
         # Check cache
-        cache_key = hash(text)
-        if cache_key in self.embedding_cache:
-            return self.embedding_cache[cache_key]
+        cached = self.embedding_cache.get(text)
+        if cached is not None:
+            self._track_embedding_width(cached)
+            return cached
         
         embedding = None
         
         # Try local model first
         if self.embedding_model:
             try:
-                embedding = self.embedding_model.encode(text, convert_to_numpy=True)
+                embedding = self.embedding_model.encode(text, convert_to_numpy=True).astype(np.float32, copy=False)
             except Exception as e:
                 print(f"[VECTORIZER] Local embedding failed: {e}")
         
@@ -86,28 +236,120 @@ class EventVectorizer:
                 embedding = self._embed_via_huggingface(text)
         
         if embedding is not None:
-            self.embedding_cache[cache_key] = embedding
+            self.embedding_cache.put(text, embedding)
+            self._track_embedding_width(embedding)
         
         return embedding
     
+    def embed_texts(self, texts: List[str]) -> Dict[str, np.ndarray]:
+        """Embed many texts at once, returning text -> embedding for those embedded
+        
+        A local model encodes every uncached text in one batched call instead
+        of one call per string; API services get batched, concurrent requests
+        (see embed_texts_remote).
+        """
+        candidates = [text for text in dict.fromkeys(texts) if text and text.strip()]
+        embeddings = self.embedding_cache.get_many(candidates)
+        missing = [text for text in candidates if text not in embeddings]
+        if embeddings:
+            self._track_embedding_width(next(iter(embeddings.values())))
+        
+        if not missing:
+            return embeddings
+        
+        if self.embedding_model:
+            try:
+                encoded = self.embedding_model.encode(
+                    missing, batch_size=self.encode_batch_size, convert_to_numpy=True
+                ).astype(np.float32, copy=False)
+                new_embeddings = dict(zip(missing, encoded))
+                self.embedding_cache.put_many(new_embeddings)
+                embeddings.update(new_embeddings)
+                self._track_embedding_width(encoded[0])
+                return embeddings
+            except Exception as e:
+                print(f"[VECTORIZER] Local batch embedding failed: {e}")
+        
+        new_embeddings = self.embed_texts_remote(missing)
+        if new_embeddings:
+            self.embedding_cache.put_many(new_embeddings)
+            embeddings.update(new_embeddings)
+            self._track_embedding_width(next(iter(new_embeddings.values())))
+        
+        return embeddings
+    
+    def embed_texts_remote(self, texts: List[str]) -> Dict[str, np.ndarray]:
+        """Embed texts via the configured API, several inputs per request
+        
+        Batches are sent concurrently over the pooled session, overlapping
+        network latency; failed batches are left out of the result.
+        """
+        if not HAS_REQUESTS or not texts:
+            return {}
+        if config.EMBEDDING_SERVICE == 'openrouter' and config.OPENROUTER_API_KEY:
+            embed_batch = self._embed_batch_via_openrouter
+        elif config.EMBEDDING_SERVICE == 'huggingface' and config.HF_TOKEN:
+            embed_batch = self._embed_batch_via_huggingface
+        else:
+            return {}
+        
+        batches = [texts[i:i + REMOTE_EMBED_BATCH_SIZE] for i in range(0, len(texts), REMOTE_EMBED_BATCH_SIZE)]
+        embeddings = {}
+        with ThreadPoolExecutor(max_workers=min(REMOTE_EMBED_WORKERS, len(batches))) as pool:
+            for batch, result in zip(batches, pool.map(embed_batch, batches)):
+                if result is not None:
+                    embeddings.update(zip(batch, result))
+        return embeddings
+    
+    def _embed_batch_via_openrouter(self, texts: List[str]) -> Optional[List[np.ndarray]]:
+        """Embed several texts in one OpenRouter request"""
+        try:
+            response = self.http_session.post(
+                OPENROUTER_EMBEDDINGS_URL,
+                headers=self._openrouter_headers,
+                data=json_dumps({
+                    'model': config.EMBEDDING_MODEL,
+                    'input': texts
+                }),
+                timeout=30
+            )
+            response.raise_for_status()
+            items = sorted(json_loads(response.content)['data'], key=lambda item: item.get('index', 0))
+            return [np.asarray(item['embedding'], dtype=np.float32) for item in items]
+        except Exception as e:
+            print(f"[VECTORIZER] OpenRouter batch embedding failed: {e}")
+            return None
+    
+    def _embed_batch_via_huggingface(self, texts: List[str]) -> Optional[List[np.ndarray]]:
+        """Embed several texts in one Hugging Face request"""
+        try:
+            response = self.http_session.post(
+                HF_EMBEDDINGS_URL,
+                headers=self._hf_headers,
+                data=json_dumps({'inputs': texts}),
+                timeout=30
+            )
+            response.raise_for_status()
+            return list(np.asarray(json_loads(response.content), dtype=np.float32))
+        except Exception as e:
+            print(f"[VECTORIZER] Hugging Face batch embedding failed: {e}")
+            return None
+    
     def _embed_via_openrouter(self, text: str) -> Optional[np.ndarray]:
         """Embed via OpenRouter API"""
         try:
-            response = requests.post(
-                'https://openrouter.ai/api/v1/embeddings',
-                headers={
-                    'Authorization': f'Bearer {config.OPENROUTER_API_KEY}',
-                    'Content-Type': 'application/json'
-                },
-                json={
+            response = self.http_session.post(
+                OPENROUTER_EMBEDDINGS_URL,
+                headers=self._openrouter_headers,
+                data=json_dumps({
                     'model': config.EMBEDDING_MODEL,
                     'input': text
-                },
+                }),
                 timeout=10
             )
             response.raise_for_status()
-            data = response.json()
-            return np.array(data['data'][0]['embedding'])
+            data = json_loads(response.content)
+            return np.asarray(data['data'][0]['embedding'], dtype=np.float32)
         except Exception as e:
             print(f"[VECTORIZER] OpenRouter embedding failed: {e}")
             return None
@@ -115,65 +357,109 @@ class EventVectorizer:
     def _embed_via_huggingface(self, text: str) -> Optional[np.ndarray]:
         """Embed via Hugging Face API"""
         try:
-            endpoint = config.HF_ENDPOINT or f'https://api-inference.huggingface.co/pipeline/feature-extraction/{config.EMBEDDING_MODEL}'
-            response = requests.post(
-                endpoint,
-                headers={
-                    'Authorization': f'Bearer {config.HF_TOKEN}',
-                    'Content-Type': 'application/json'
-                },
-                json={'inputs': text},
+            response = self.http_session.post(
+                HF_EMBEDDINGS_URL,
+                headers=self._hf_headers,
+                data=json_dumps({'inputs': text}),
                 timeout=10
             )
             response.raise_for_status()
-            return np.array(response.json())
+            return np.asarray(json_loads(response.content), dtype=np.float32)
         except Exception as e:
             print(f"[VECTORIZER] Hugging Face embedding failed: {e}")
             return None
     
-    def vectorize_event(self, event: Dict, prompt_text: Optional[str] = None) -> Dict:
-        """Vectorize a single event"""
-        # One-hot encode event type
-        event_type_vector = self.one_hot_encode_event_type(event.get('type', ''))
+    def vectorize_event(self, event: Dict, prompt_text: Optional[str] = None,
+                        prompt_embedding: Optional[np.ndarray] = None) -> Dict:
+        """Vectorize a single event
         
-        # Embed prompt text (synchronous for now, can be made async)
-        prompt_embedding = None
-        if prompt_text:
-            # For now, use a placeholder - in production this would be async
-            # For batch processing, we'll handle embeddings separately
-            pass
+        Prompt embeddings are computed up front in batch (see embed_texts)
+        and passed in; events without one get a zero block of the same width.
+        The event type is emitted as an index into the encoder, not one-hot.
+        """
+        # Event type as a compact index (-1 if unknown); clustering expands
+        # it to one-hot rows in a single contiguous block
+        event_type_idx = self.event_type_map.get(event.get('type', ''), -1)
         
-        # Combine vectors
-        combined_vector = event_type_vector.tolist()
+        # Prompt embedding block, kept as a float32 array (converted to lists
+        # only when written as JSON)
         if prompt_embedding is not None:
-            combined_vector.extend(prompt_embedding.tolist())
+            combined_vector = np.asarray(prompt_embedding, dtype=np.float32)
+            self._track_embedding_width(combined_vector)
         else:
-            # Placeholder zeros for prompt embedding (768 dim for all-mpnet-base-v2)
-            combined_vector.extend([0.0] * 768)
+            # Placeholder zeros for prompt embedding
+            combined_vector = self._zero_embedding()
         
         return {
             'event_id': event.get('id'),
             'timestamp': event.get('timestamp'),
             'event_type': event.get('type'),
-            'event_type_vector': event_type_vector.tolist(),
+            'event_type_idx': event_type_idx,
             'prompt_text': prompt_text,
             'combined_vector': combined_vector
         }
     
-    def vectorize_sequence(self, events: List[Dict], prompts_map: Dict[int, Dict] = None) -> List[Dict]:
-        """Vectorize a sequence of events"""
+    def _zero_embedding(self) -> np.ndarray:
+        """Shared read-only zero block used when an event has no prompt embedding"""
+        zeros = self._zeros
+        if zeros is None or zeros.shape[0] != self.embedding_dim:
+            zeros = np.zeros(self.embedding_dim, dtype=np.float32)
+            zeros.flags.writeable = False
+            self._zeros = zeros
+        return zeros
+    
+    def vectorize_sequence_arrays(self, events: List[Dict], prompts_map: Dict[int, Dict] = None,
+                                  embeddings: Optional[Dict[str, np.ndarray]] = None
+                                  ) -> Tuple[List[Dict], np.ndarray, np.ndarray]:
+        """Vectorize a sequence into contiguous arrays
+        
+        Returns (sequence, event_type_idx, vectors): an int32 (L,) array of
+        event type indices and an (L, D) float32 block filled row by row.
+        Each event record's combined_vector is a view of its row, not a copy.
+        """
         if prompts_map is None:
             prompts_map = {}
+        if embeddings is None:
+            embeddings = {}
+        
+        if embeddings:
+            self._track_embedding_width(next(iter(embeddings.values())))
+        
+        type_map = self.event_type_map
+        event_type_idx = np.fromiter((type_map.get(e.get('type', ''), -1) for e in events),
+                                     dtype=np.int32, count=len(events))
+        # Rows without a prompt embedding stay zero
+        vectors = np.zeros((len(events), self.embedding_dim), dtype=np.float32)
         
         sequence = []
-        for event in events:
+        for i, event in enumerate(events):
             prompt_id = event.get('prompt_id')
             prompt_text = None
             if prompt_id and prompt_id in prompts_map:
                 prompt_text = prompts_map[prompt_id].get('text')
             
-            vectorized = self.vectorize_event(event, prompt_text)
-            sequence.append(vectorized)
+            embedding = embeddings.get(prompt_text)
+            if embedding is not None:
+                vectors[i] = embedding
+            
+            sequence.append({
+                'event_id': event.get('id'),
+                'timestamp': event.get('timestamp'),
+                'event_type': event.get('type'),
+                'event_type_idx': int(event_type_idx[i]),
+                'prompt_text': prompt_text,
+                'combined_vector': vectors[i]
+            })
         
-        return sequence
-
+        return sequence, event_type_idx, vectors
+    
+    def vectorize_sequence(self, events: List[Dict], prompts_map: Dict[int, Dict] = None,
+                           embeddings: Optional[Dict[str, np.ndarray]] = None) -> List[Dict]:
+        """Vectorize a sequence of events"""
+        return self.vectorize_sequence_arrays(events, prompts_map, embeddings)[0]
+    
+    def close(self):
+        """Close pooled HTTP connections and the embedding cache"""
+        if self.http_session:
+            self.http_session.close()
+        self.embedding_cache.close()